@@ -4,10 +4,155 @@ import sys
 import os.path
 from collections import defaultdict
 import argparse
+import json
 import otf2
+from otf2_pipeline import Pipeline, Stage, window_ticks
 
+from eventclassifier import EventClassifier
 from spacecollection import AddressSpace, AccessType
-from spacestatistics import MemoryAccessStatistics
+from spacestatistics import MemoryAccessStatistics, MetricOptions
+from locality import GRANULARITIES, get_block_size
+from parallel import map_spaces, create_shard_metrics
+from eventcopy import keep_time_range, copy_location_files
+
+
+def add_column_accesses(store, locations, stats, begin=None, end=None):
+    """
+    Adds the mapped spaces and accesses of the Mmap and Metric columns exported by otf2_columns.py to stats,
+    only those with begin <= time < end (timestamps, None stays open).
+    locations are the locations of the exported trace in definition order.
+    """
+    def in_window(t):
+        return (begin is None or t >= begin) and (end is None or t < end)
+
+    manifest = store.manifest
+    access_types = {i: AccessType.get_by_name(member["name"])
+                    for i, member in enumerate(manifest["metric_members"]) if AccessType.contains(member["name"])}
+    for i in range(len(locations)):
+        mmaps = store.columns(i, "Mmap")
+        for t, address, size, source in zip(*(mmaps[column].tolist() for column in ("time", "address", "size", "source"))):
+            if not in_window(t):
+                continue
+            space = AddressSpace(time=t)
+            space.Address = address
+            space.Size = size
+            space.Source = manifest["sources"][source]
+            stats.add_mapped_space(space)
+    for i, location in enumerate(locations):
+        metrics = store.columns(i, "Metric")
+        for t, member, value in zip(*(metrics[column].tolist() for column in ("time", "member", "value"))):
+            access_type = access_types.get(member)
+            if access_type is not None and in_window(t):
+                stats.add_address(t, value, location, access_type)
+
+
+class AccessStatisticsStage(Stage):
+    """
+    Copies all events into the rewritten trace, attributes memory accesses and creates the access metrics.
+    """
+
+    event_types = (otf2.events._Event,)
+
+    def __init__(self, trace_file, accesses=False, counters=False, intervals=False, locality=False,
+                 every=1, interval_length=0.01, granularity="line", window=0.01,
+                 summary="locality_stats.json", jobs=1, output="rewrite", time_window=(None, None)):
+        self.trace_file = trace_file
+        self.accesses = accesses
+        self.counters = counters
+        self.intervals = intervals
+        self.locality = locality
+        self.every = every
+        self.interval_length = interval_length
+        self.block_size = get_block_size(granularity)
+        self.window = window
+        self.summary = summary
+        self.jobs = jobs
+        self.output = output
+        # Analysed (begin, end) window in seconds since the trace start, None stays open
+        self.time_window = time_window
+        self.stats = MemoryAccessStatistics()
+
+
+    def begin(self, trace):
+        self._definitions = trace.definitions
+        self._trace_writer = otf2.writer.Writer(self.output, definitions=trace.definitions)
+        self._classifier = EventClassifier(trace.definitions)
+        for space in self._classifier.property_spaces():
+            self.stats.add_mapped_space(space)
+        self._event_writers = {}
+
+
+    def process(self, location, event):
+        event_writer = self._event_writers.get(location)
+        if event_writer is None:
+            event_writer = self._event_writers[location] = self._trace_writer.event_writer_from_location(location)
+        event_writer(event)
+        space = self._classifier.mapped_space(event)
+        if space is not None:
+            self.stats.add_mapped_space(space)
+        access_type = self._classifier.access_type(event)
+        if access_type is not None:
+            self.stats.add_access(event, location, access_type)
+
+
+    def finalize(self):
+        summary = self.stats.create_metrics(self._trace_writer, self._definitions.clock_properties, self.metric_options())
+        self._write_summary(summary)
+        self._trace_writer.close()
+        return self.stats
+
+
+    def metric_options(self):
+        return MetricOptions(self.accesses, self.counters, self.intervals, self.locality,
+                             self.every, self.interval_length, self.block_size, self.window)
+
+
+    def _write_summary(self, summary):
+        if summary is not None:
+            with open(self.summary, 'w') as file:
+                json.dump(summary, file)
+
+
+    def run_parallel(self):
+        """
+        Runs the analysis with self.jobs worker processes instead of a pipeline pass.
+        The workers first collect the mapped spaces, then attribute the accesses and create the
+        metrics of their own locations, which are merged into the rewritten trace. The event files
+        of the trace are copied into the rewritten trace instead of being decoded and written again.
+        Returns self.stats, which only holds the mapped spaces, the accesses stay in the workers.
+        """
+        with otf2.reader.open(self.trace_file) as trace:
+            locations = list(trace.definitions.locations)
+            self.begin(trace)
+            keep_time_range(self._trace_writer, trace.definitions.clock_properties)
+            map_spaces(self.trace_file, trace.definitions, self.stats, self.jobs, self.time_window)
+            summary = create_shard_metrics(self.trace_file, trace.definitions, self._trace_writer,
+                                           self.stats, self.metric_options(), self.jobs, self.time_window)
+            self._write_summary(summary)
+            self._trace_writer.close()
+        copy_location_files(self.trace_file, locations, self.output)
+        return self.stats
+
+
+    def run_columns(self, columns_path):
+        """
+        Runs the analysis on the Mmap and Metric columns exported by otf2_columns.py instead of
+        decoding the events. The trace still provides the definitions and the event files
+        copied into the rewritten trace.
+        """
+        from otf2_columns import ColumnStore
+        store = ColumnStore(columns_path)
+        with otf2.reader.open(self.trace_file) as trace:
+            locations = list(trace.definitions.locations)
+            if len(locations) != len(store.locations):
+                raise ValueError("The columns in {} were not exported from {}".format(columns_path, self.trace_file))
+            self.begin(trace)
+            keep_time_range(self._trace_writer, trace.definitions.clock_properties)
+            add_column_accesses(store, locations, self.stats,
+                                *window_ticks(trace.definitions.clock_properties, self.time_window))
+            stats = self.finalize()
+        copy_location_files(self.trace_file, locations, self.output)
+        return stats
 
 
 if __name__ == "__main__":
@@ -15,21 +160,35 @@ if __name__ == "__main__":
     parser.add_argument("trace", help="Path to trace file i.e. trace.otf2", type=str)
     parser.add_argument('--counters', action="store_true", help='Creates metrics which counts the number of accesses per source.')
     parser.add_argument('--accesses', action="store_true", help='Creates metrics that contains the virtual address accessed source.')
+    parser.add_argument('--every', type=int, default=1, help='Writes only every Nth access or counter update with --accesses and --counters.')
+    parser.add_argument('--intervals', action="store_true", help='Creates metrics with load/store counts and min/max address per interval and source.')
+    parser.add_argument('--interval_length', type=float, default=0.01, help='Specifies the length of an interval in seconds(float).')
+    parser.add_argument('--locality', action="store_true", help='Creates reuse-distance and working-set metrics per source and writes a summary file.')
+    parser.add_argument('--granularity', default="line", help='Block granularity of the locality analysis: {} or a size in bytes.'.format(", ".join(GRANULARITIES)))
+    parser.add_argument('--window', type=float, default=0.01, help='Length of a working-set window in seconds(float).')
+    parser.add_argument('--begin', type=float, help='Start of the analysed time window in seconds(float) since the trace start. Only spaces mapped and accesses within the window are attributed.')
+    parser.add_argument('--end', type=float, help='End of the analysed time window in seconds(float) since the trace start.')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes, each attributing the accesses and creating the metrics of its own locations.')
+    parser.add_argument('--columns', type=str, help='Read mapped spaces and accesses from a directory exported by otf2_columns.py with --events Metric Mmap instead of decoding the trace.')
+    parser.add_argument('--summary', type=str, default="locality_stats.json", help='Path of the locality summary file.')
     args = parser.parse_args()
 
-    if args.accesses or args.counters:
-        stats = MemoryAccessStatistics()
-        with otf2.reader.open(args.trace) as trace_reader:
-            trace_writer = otf2.writer.Writer("rewrite", definitions=trace_reader.definitions)
-            for location, event in trace_reader.events:
-                event_writer = trace_writer.event_writer_from_location(location)
-                event_writer(event)
-                space = AddressSpace(attributes=event.attributes)
-                if space.initialized():
-                    stats.add_mapped_space(space)
-                if isinstance(event, otf2.events.Metric) and AccessType.contains(event.metric.member.name):
-                    stats.add_access(event, location)
-            if args.accesses:
-                stats.create_access_metrics(trace_writer)
-            if args.counters:
-                stats.create_counter_metrics(trace_writer)
+    if args.every < 1:
+        sys.exit("--every must be at least 1.")
+    if args.jobs < 1:
+        sys.exit("--jobs must be at least 1.")
+    if args.columns and args.jobs > 1:
+        sys.exit("--columns cannot be combined with --jobs.")
+
+    if args.accesses or args.counters or args.intervals or args.locality:
+        stage = AccessStatisticsStage(args.trace, accesses=args.accesses, counters=args.counters,
+                                      intervals=args.intervals, locality=args.locality, every=args.every,
+                                      interval_length=args.interval_length, granularity=args.granularity,
+                                      window=args.window, summary=args.summary, jobs=args.jobs,
+                                      time_window=(args.begin, args.end))
+        if args.columns:
+            stage.run_columns(args.columns)
+        elif args.jobs > 1:
+            stage.run_parallel()
+        else:
+            Pipeline([stage]).run(args.trace, stage.time_window)
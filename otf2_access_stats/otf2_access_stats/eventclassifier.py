@@ -0,0 +1,67 @@
+from collections import defaultdict
+
+import otf2
+
+from spacecollection import AddressSpace, AccessType, MMAP_TAGS, SCOREP_MEMORY_TAGS
+
+
+class EventClassifier:
+    """
+    Classifies events by attribute and metric references resolved once from the definitions.
+
+    Events that carry none of the mmap attributes and no access metric are
+    rejected by a set lookup without allocating an AddressSpace.
+    """
+
+    def _resolve_access_metrics(self, definitions):
+        for metric_class in definitions.metric_classes:
+            members = list(metric_class.members)
+            if len(members) == 1 and AccessType.contains(members[0].name):
+                self._access_metrics[metric_class] = AccessType.get_by_name(members[0].name)
+        for metric_instance in definitions.metric_instances:
+            if metric_instance.metric_class in self._access_metrics:
+                self._access_metrics[metric_instance] = self._access_metrics[metric_instance.metric_class]
+
+
+    def __init__(self, definitions):
+        self._definitions = definitions
+        self._mmap_attributes = frozenset(attribute for attribute in definitions.attributes
+                                          if attribute.name in MMAP_TAGS)
+        self._access_metrics = {}
+        self._resolve_access_metrics(definitions)
+
+
+    def mapped_space(self, event):
+        """
+        Returns the AddressSpace mapped by the event or None.
+        """
+        attributes = event.attributes
+        if not attributes or self._mmap_attributes.isdisjoint(attributes):
+            return None
+        space = AddressSpace(attributes=attributes, time=event.time)
+        if space.initialized():
+            return space
+        return None
+
+
+    def access_type(self, event):
+        """
+        Returns the AccessType of a memory access metric event or None.
+        """
+        if not isinstance(event, otf2.events.Metric):
+            return None
+        return self._access_metrics.get(event.metric)
+
+
+    def property_spaces(self):
+        """
+        Yields the address spaces announced by Score-P scorep:memoryaddress:* location properties.
+        """
+        properties = defaultdict(list)
+        for prop in self._definitions.location_properties:
+            if prop.name in SCOREP_MEMORY_TAGS:
+                properties[prop.location].append(prop)
+        for location_properties in properties.values():
+            space = AddressSpace(properties=location_properties)
+            if space.initialized():
+                yield space
@@ -0,0 +1,37 @@
+"""
+Rewritten traces that take over the events of their input by copying its event files.
+
+The OTF2 Python bindings can only copy events by decoding and writing each of them again,
+a serial pass over the whole trace. The event and local definition files of a location only
+refer to definitions by their ids, and the rewritten trace is written with the definitions
+of its input, so the copied files stay valid. This relies on internals of the bindings
+(Location._ref, Writer._update_timestamps) and on the file layout of POSIX archives,
+which is why it is kept in this module.
+"""
+import os.path
+import shutil
+
+
+def keep_time_range(trace_writer, clock_properties):
+    """
+    Makes the writer keep the time range of the input trace. The copied events do not
+    pass through the writer, which otherwise derives the range from the written events.
+    """
+    trace_writer._update_timestamps(clock_properties.global_offset)
+    trace_writer._update_timestamps(clock_properties.global_offset + clock_properties.trace_length)
+
+
+def copy_location_files(trace_file, locations, output, archive_name="traces"):
+    """
+    Copies the event and local definition files of the locations from the trace into
+    the closed archive at output, replacing the empty files written for them.
+    """
+    source = os.path.splitext(trace_file)[0]
+    target = os.path.join(output, archive_name)
+    for location in locations:
+        event_file = os.path.join(source, "{}.evt".format(location._ref))
+        if location.number_of_events and not os.path.exists(event_file):
+            raise ValueError("Cannot copy the events of {}, {} does not exist.".format(location.name, event_file))
+        for path in (event_file, os.path.join(source, "{}.def".format(location._ref))):
+            if os.path.exists(path):
+                shutil.copyfile(path, os.path.join(target, os.path.basename(path)))
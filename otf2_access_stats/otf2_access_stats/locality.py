@@ -0,0 +1,133 @@
+from collections import defaultdict
+
+GRANULARITIES = {"line": 64, "page": 4096}
+COLD_MISS = "cold"
+
+
+def get_block_size(granularity):
+    """
+    Returns the block size in bytes for "line", "page" or an explicit number of bytes.
+    """
+    if granularity in GRANULARITIES:
+        return GRANULARITIES[granularity]
+    block_size = int(granularity)
+    if block_size <= 0:
+        raise ValueError("Block size must be positive, got {}.".format(granularity))
+    return block_size
+
+
+def get_histogram_bin(distance):
+    """
+    Maps a reuse distance to its logarithmic histogram bin, e.g. 5 -> "4-7".
+    """
+    if distance is None:
+        return COLD_MISS
+    if distance < 2:
+        return str(distance)
+    lower = 1 << (distance.bit_length() - 1)
+    return "{}-{}".format(lower, 2 * lower - 1)
+
+
+class FenwickTree:
+    """
+    Binary indexed tree supporting point updates and prefix sums in O(log N).
+    """
+
+    def __init__(self, size):
+        self._tree = [0] * (size + 1)
+
+
+    def add(self, index, delta):
+        index += 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+
+    def prefix_sum(self, index):
+        """
+        Returns the sum of the entries [0, index).
+        """
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+
+class LocalityStatistics:
+    """
+    Computes reuse distances and working-set sizes of one access sequence.
+
+    The reuse (stack) distance of an access is the number of distinct blocks
+    touched since the previous access to the same block. Every block marks the
+    position of its last access in a Fenwick tree, so a distance is a range sum
+    and the whole sequence is processed in O(N log N).
+    """
+
+    def __init__(self, access_count, block_size, window, start=0):
+        self._tree = FenwickTree(access_count)
+        self._last_use = {}
+        self._position = 0
+        self._block_size = block_size
+        self._window = window
+        self._start = start
+        self._window_index = None
+        self._window_blocks = set()
+        self.histogram = defaultdict(int)
+        self.working_set = []
+
+
+    def _reuse_distance(self, block):
+        previous = self._last_use.get(block)
+        distance = None
+        if previous is not None:
+            distance = self._tree.prefix_sum(self._position) - self._tree.prefix_sum(previous + 1)
+            self._tree.add(previous, -1)
+        self._tree.add(self._position, 1)
+        self._last_use[block] = self._position
+        self._position += 1
+        return distance
+
+
+    def _flush_window(self):
+        if self._window_index is None:
+            return
+        begin = self._start + self._window_index * self._window
+        self.working_set.append((begin, len(self._window_blocks)))
+        self._window_blocks = set()
+
+
+    def _update_working_set(self, timestamp, block):
+        window_index = (timestamp - self._start) // self._window
+        if window_index != self._window_index:
+            last_index = self._window_index
+            self._flush_window()
+            if last_index is not None and window_index > last_index + 1:
+                # Close the gap so the working set drops to zero in idle windows.
+                self.working_set.append((self._start + (last_index + 1) * self._window, 0))
+            self._window_index = window_index
+        self._window_blocks.add(block)
+
+
+    def add(self, timestamp, address):
+        """
+        Adds the next access and returns its reuse distance, or None for a cold miss.
+        """
+        block = address // self._block_size
+        self._update_working_set(timestamp, block)
+        distance = self._reuse_distance(block)
+        self.histogram[get_histogram_bin(distance)] += 1
+        return distance
+
+
+    def finish(self):
+        self._flush_window()
+        self._window_index = None
+
+
+    def to_dict(self):
+        return {"accesses": self._position,
+                "distinct_blocks": len(self._last_use),
+                "histogram": dict(self.histogram),
+                "working_set": self.working_set}
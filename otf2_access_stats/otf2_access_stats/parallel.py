@@ -0,0 +1,177 @@
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+
+import otf2
+from otf2_pipeline import window_events, window_ticks
+from otf2_timeindex import load_index, seek_events
+
+from eventclassifier import EventClassifier
+from metricdict import MetricDict
+from spacestatistics import MemoryAccessStatistics
+
+
+class MetricStream:
+    """
+    Metric events of one metric location, recorded in place of an otf2 event writer.
+    """
+
+    def __init__(self):
+        self.times = []
+        self.values = []
+
+
+    def metric(self, time, metric, value):
+        self.times.append(time)
+        self.values.append(value)
+
+
+class MetricRecorder:
+    """
+    Takes the place of the trace writer when a worker creates the metrics of its shard.
+    Metric definitions are created in the registry of the worker's reader and the events
+    are recorded per metric location, so they can be sent to the coordinator.
+    """
+
+    def __init__(self, definitions):
+        self.definitions = definitions
+        self._streams = OrderedDict()
+
+
+    def event_writer_from_location(self, location):
+        stream = self._streams.get(location)
+        if stream is None:
+            stream = self._streams[location] = MetricStream()
+        return stream
+
+
+    def get_streams(self, locations):
+        """
+        Returns a (metric key, scope location index, metric name, unit, value type, times, values)
+        tuple per metric location. locations are the trace locations in definition order.
+        """
+        location_index = {location: i for i, location in enumerate(locations)}
+        instances = {instance.recorder: instance for instance in self.definitions.metric_instances}
+        streams = []
+        for metric_location, stream in self._streams.items():
+            instance = instances[metric_location]
+            member = instance.metric_class.members[0]
+            streams.append((metric_location.name, location_index[instance.scope], member.name,
+                            member.unit, member.value_type, stream.times, stream.values))
+        return streams
+
+
+def balance_locations(event_counts, jobs):
+    """
+    Splits location indices into at most jobs shards with similar event counts.
+    event_counts maps location index to number of events.
+    """
+    shards = [(0, i, []) for i in range(jobs)]
+    for location_index in sorted(event_counts, key=event_counts.get, reverse=True):
+        count, i, shard = heapq.heappop(shards)
+        shard.append(location_index)
+        heapq.heappush(shards, (count + event_counts[location_index], i, shard))
+    return [shard for _, _, shard in sorted(shards, key=lambda s: s[1]) if shard]
+
+
+def location_shards(definitions, jobs):
+    """
+    Location index shards balanced by the event counts stored in the definitions.
+    """
+    counts = {i: location.number_of_events for i, location in enumerate(definitions.locations)}
+    return balance_locations(counts, jobs)
+
+
+def shard_events(trace_reader, trace_file, location_indices, window):
+    """
+    Events of the given locations within the (begin, end) window in seconds,
+    seeking to the window with the time index of the trace if one exists.
+    """
+    definitions = trace_reader.definitions
+    locations = list(definitions.locations)
+    events = seek_events(trace_reader, load_index(trace_file), window[0], [locations[i] for i in location_indices])
+    return window_events(events, *window_ticks(definitions.clock_properties, window))
+
+
+def map_shard(trace_file, location_indices, window=(None, None)):
+    """
+    Worker: returns the address spaces mapped by events of the given locations within the time window.
+    Only the mmap attributes of the events are inspected.
+    """
+    with otf2.reader.open(trace_file) as trace_reader:
+        classifier = EventClassifier(trace_reader.definitions)
+        spaces = []
+        for _, event in shard_events(trace_reader, trace_file, location_indices, window):
+            space = classifier.mapped_space(event)
+            if space is not None:
+                spaces.append(space)
+        return spaces
+
+
+def analyse_shard(trace_file, location_indices, spaces, options, window=(None, None)):
+    """
+    Worker: attributes the accesses of the given locations within the time window to the
+    mapped spaces and creates their metrics as selected by options (MetricOptions).
+    Returns the recorded metric streams (see MetricRecorder.get_streams) and the locality summary.
+    """
+    stats = MemoryAccessStatistics()
+    for space in spaces:
+        stats.add_mapped_space(space)
+    with otf2.reader.open(trace_file) as trace_reader:
+        definitions = trace_reader.definitions
+        locations = list(definitions.locations)
+        classifier = EventClassifier(definitions)
+        for location, event in shard_events(trace_reader, trace_file, location_indices, window):
+            access_type = classifier.access_type(event)
+            if access_type is not None:
+                stats.add_access(event, location, access_type)
+        recorder = MetricRecorder(definitions)
+        summary = stats.create_metrics(recorder, definitions.clock_properties, options)
+        return recorder.get_streams(locations), summary
+
+
+def map_spaces(trace_file, definitions, stats, jobs, window=(None, None)):
+    """
+    Adds the spaces mapped by the events of all locations within the time window to stats,
+    using jobs worker processes that each read their own locations.
+    """
+    shards = location_shards(definitions, jobs)
+    with ProcessPoolExecutor(jobs) as pool:
+        for spaces in pool.map(map_shard, [trace_file] * len(shards), shards, [window] * len(shards)):
+            for space in spaces:
+                stats.add_mapped_space(space)
+
+
+def write_metric_streams(trace_writer, async_metrics, locations, streams):
+    """
+    Writes metric streams recorded by a worker (see MetricRecorder.get_streams), creating their
+    definitions through async_metrics (MetricDict). locations are the trace locations in definition order.
+    """
+    for metric_key, scope, metric_name, unit, value_type, times, values in streams:
+        metric = async_metrics.get(locations[scope], metric_name, metric_key, unit=unit, value_type=value_type)
+        writer = trace_writer.event_writer_from_location(metric.location)
+        for t, value in zip(times, values):
+            writer.metric(t, metric.instance, value)
+
+
+def create_shard_metrics(trace_file, definitions, trace_writer, stats, options, jobs, window=(None, None)):
+    """
+    Creates the metrics selected by options with jobs worker processes, each attributing the
+    accesses of its own location shard to the spaces mapped in stats and creating their metrics.
+    Here only the metric definitions are created and the recorded events are written.
+    Returns the merged locality summary or None.
+    """
+    locations = list(definitions.locations)
+    spaces = stats.get_mapped_spaces()
+    async_metrics = MetricDict(trace_writer)
+    summary = defaultdict(dict) if options.locality else None
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(analyse_shard, trace_file, shard, spaces, options, window)
+                   for shard in location_shards(definitions, jobs)]
+        for future in futures:
+            streams, shard_summary = future.result()
+            write_metric_streams(trace_writer, async_metrics, locations, streams)
+            if shard_summary:
+                for space_key, location_summaries in shard_summary.items():
+                    summary[space_key].update(location_summaries)
+    return summary
@@ -6,8 +6,11 @@ MMAP_ADDRESS_TAG = "startAddress"
 MMAP_SOURCE_TAG = "mappedSource"
 SCOREP_MEMORY_ADDRESS = "scorep:memoryaddress:begin"
 SCOREP_MEMORY_SIZE = "scorep:memoryaddress:len"
+MMAP_TAGS = frozenset((MMAP_SIZE_TAG, MMAP_ADDRESS_TAG, MMAP_SOURCE_TAG))
+SCOREP_MEMORY_TAGS = frozenset((SCOREP_MEMORY_ADDRESS, SCOREP_MEMORY_SIZE))
 
 Access = namedtuple('Access', ['address','type'])
+IntervalAggregate = namedtuple('IntervalAggregate', ['begin', 'loads', 'stores', 'min_address', 'max_address'])
 
 
 class AccessType (Enum):
@@ -49,6 +52,30 @@ class AccessSequence:
             yield t, a
 
 
+    def aggregate(self, interval, start=0):
+        """
+        Yields an IntervalAggregate for every interval of the given length that contains accesses.
+        An empty aggregate without addresses marks the first interval after a gap.
+        """
+        current = None
+        for t, a in self._accesses.items():
+            index = (t - start) // interval
+            if current is None or index != current[0]:
+                if current is not None:
+                    yield IntervalAggregate(*current[1:])
+                    if index > current[0] + 1:
+                        yield IntervalAggregate(start + (current[0] + 1) * interval, 0, 0, None, None)
+                current = [index, start + index * interval, 0, 0, a.address, a.address]
+            if a.type == AccessType.LOAD:
+                current[2] += 1
+            elif a.type == AccessType.STORE:
+                current[3] += 1
+            current[4] = min(current[4], a.address)
+            current[5] = max(current[5], a.address)
+        if current is not None:
+            yield IntervalAggregate(*current[1:])
+
+
     def __len__(self):
         return len(self._accesses)
 
@@ -76,7 +103,7 @@ class AddressSpace:
 
 
     def _init_by_properties(self, properties):
-        for prop in trace.definitions.location_properties:
+        for prop in properties:
             if prop.name == SCOREP_MEMORY_ADDRESS:
                 self.Address = int(prop.value)
             elif prop.name == SCOREP_MEMORY_SIZE:
@@ -84,10 +111,12 @@ class AddressSpace:
         self.Source = "Score-P"
 
 
-    def __init__(self, attributes=None, properties=None):
+    def __init__(self, attributes=None, properties=None, time=None):
         self.Size = -1
         self.Source = ""
         self.Address = -1
+        # Timestamp of the mapping event, None if mapped from the start
+        self.Time = time
         self.Accesses = defaultdict(AccessSequence)
         if attributes:
             self._init_by_attributes(attributes)
@@ -108,6 +137,10 @@ class AddressSpace:
         return self.Size != -1 and self.Address != -1
 
 
+    def mapped_at(self, timestamp):
+        return self.Time is None or timestamp >= self.Time
+
+
     def __str__(self):
         return "[{}, {}] = Size: {}, Source {}".format(
             self.Address,
@@ -1,5 +1,5 @@
 import sys
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import argparse
 from intervaltree import Interval, IntervalTree
 
@@ -7,9 +7,23 @@ import otf2
 from otf2.enums import Type
 
 from metricdict import MetricDict
+from locality import LocalityStatistics
 from spacecollection import AccessType, AccessSequence, AddressSpace, Access
 
 
+# Metrics to create and their parameters, interval_length and window in seconds
+MetricOptions = namedtuple('MetricOptions', ['accesses', 'counters', 'intervals', 'locality',
+                                             'every', 'interval_length', 'block_size', 'window'])
+
+
+def _get_counter(trace_writer, async_metrics, source, prefix, location, unit="#"):
+    metric_name = "{}:{}".format(prefix, source)
+    metric_key = "{}:{}".format(metric_name, str(location.name))
+    metric = async_metrics.get(location, metric_name, metric_key, unit=unit, value_type=Type.UINT64)
+    writer = trace_writer.event_writer_from_location(metric.location)
+    return metric, writer, metric_key
+
+
 class MemoryAccessStatistics:
     """
     Stores access statistics of all utilized address spaces.
@@ -25,18 +39,32 @@ class MemoryAccessStatistics:
                                   space)
 
 
-    def add_access(self, event, location):
-        intervals = self._address_spaces[int(event.value)]
-        assert(len(intervals) < 2)
-        if len(intervals) == 1:
-            address = int(event.value)
+    def add_access(self, event, location, access_type=None):
+        if access_type is None:
             access_type = AccessType.get_by_name(event.metric.member.name)
-            intervals.pop().data.add_access_on_location(event.time,
-                                                        Access(address, access_type),
-                                                        location)
+        self.add_address(event.time, int(event.value), location, access_type)
 
 
-    def create_access_metrics(self, trace_writer):
+    def add_address(self, timestamp, address, location, access_type):
+        """
+        Attributes an access to the space containing the address, if any.
+        """
+        intervals = self._address_spaces[address]
+        assert(len(intervals) < 2)
+        if len(intervals) == 1:
+            space = intervals.pop().data
+            if not space.mapped_at(timestamp):
+                # The space is known from a first pass, but was not mapped yet
+                return
+            space.add_access_on_location(timestamp,
+                                         Access(address, access_type),
+                                         location)
+
+
+    def create_access_metrics(self, trace_writer, every=1):
+        """
+        Writes the accessed address of every Nth access per source and location.
+        """
         async_metrics = MetricDict(trace_writer)
         for space in self._address_spaces:
             for location, access_seq in space.data.get_all_accesses():
@@ -48,34 +76,119 @@ class MemoryAccessStatistics:
 
                 writer = trace_writer.event_writer_from_location(metric.location)
 
-                for t, a in access_seq.get():
-                    writer.metric(t, metric.instance, a.address)
-
-
-    def create_counter_metrics(self, trace_writer):
+                for i, (t, a) in enumerate(access_seq.get()):
+                    if i % every == 0:
+                        writer.metric(t, metric.instance, a.address)
 
-        def _get_counter(async_metrics, source, prefix, location, unit="#"):
-            metric_name = "{}:{}".format(prefix, source)
-            metric_key = "{}:{}".format(metric_name, str(location.name))
-            metric = async_metrics.get(location, metric_name, metric_key, unit=unit, value_type=Type.UINT64)
-            writer = trace_writer.event_writer_from_location(metric.location)
-            return metric, writer, metric_key
 
+    def create_counter_metrics(self, trace_writer, every=1):
+        """
+        Writes load and store counters per source and location, updated on every Nth access.
+        The final value of a counter is always written.
+        """
         async_metrics = MetricDict(trace_writer)
         counters = defaultdict(int)
         for space in self._address_spaces:
             for location, access_seq in space.data.get_all_accesses():
-                (load_metric, load_writer, load_key) = _get_counter(async_metrics, space.data.Source, "LoadCounter", location)
-                (store_metric, store_writer, store_key) = _get_counter(async_metrics, space.data.Source, "StoreCounter", location)
+                (load_metric, load_writer, load_key) = _get_counter(trace_writer, async_metrics, space.data.Source, "LoadCounter", location)
+                (store_metric, store_writer, store_key) = _get_counter(trace_writer, async_metrics, space.data.Source, "StoreCounter", location)
+                last_load = last_store = None
                 for t, a in access_seq.get():
                     if a.type == AccessType.LOAD:
                         counters[load_key] += 1
-                        load_writer.metric(t, load_metric.instance, counters[load_key])
+                        last_load = t
+                        if counters[load_key] % every == 0:
+                            load_writer.metric(t, load_metric.instance, counters[load_key])
                     elif a.type == AccessType.STORE:
                         counters[store_key] += 1
-                        store_writer.metric(t, store_metric.instance, counters[store_key])
+                        last_store = t
+                        if counters[store_key] % every == 0:
+                            store_writer.metric(t, store_metric.instance, counters[store_key])
                     else:
                         print("Found invalid access type.", file=sys.stderr)
+                if last_load is not None and counters[load_key] % every != 0:
+                    load_writer.metric(last_load, load_metric.instance, counters[load_key])
+                if last_store is not None and counters[store_key] % every != 0:
+                    store_writer.metric(last_store, store_metric.instance, counters[store_key])
+
+
+    def create_interval_metrics(self, trace_writer, interval, start=0):
+        """
+        Writes load/store counts and the min/max accessed address per interval, space and location.
+        The output size scales with the trace duration instead of the number of accesses.
+        """
+        async_metrics = MetricDict(trace_writer)
+        for space in self._address_spaces:
+            source = "{}:{:#x}".format(space.data.Source, space.data.Address)
+            for location, access_seq in space.data.get_all_accesses():
+                (load_metric, load_writer, _) = _get_counter(trace_writer, async_metrics, source, "IntervalLoads", location)
+                (store_metric, store_writer, _) = _get_counter(trace_writer, async_metrics, source, "IntervalStores", location)
+                (min_metric, min_writer, _) = _get_counter(trace_writer, async_metrics, source, "MinAddress", location, unit="address")
+                (max_metric, max_writer, _) = _get_counter(trace_writer, async_metrics, source, "MaxAddress", location, unit="address")
+                for aggregate in access_seq.aggregate(interval, start):
+                    load_writer.metric(aggregate.begin, load_metric.instance, aggregate.loads)
+                    store_writer.metric(aggregate.begin, store_metric.instance, aggregate.stores)
+                    if aggregate.min_address is not None:
+                        min_writer.metric(aggregate.begin, min_metric.instance, aggregate.min_address)
+                        max_writer.metric(aggregate.begin, max_metric.instance, aggregate.max_address)
+
+
+    def create_locality_metrics(self, trace_writer, block_size, window, start=0):
+        """
+        Writes reuse-distance and working-set metrics per space and location.
+        Returns a summary dict with the reuse-distance histograms and working-set sizes.
+        """
+        async_metrics = MetricDict(trace_writer)
+        summary = defaultdict(dict)
+        for space in self._address_spaces:
+            space_key = "{}:{:#x}".format(space.data.Source, space.data.Address)
+            for location, access_seq in space.data.get_all_accesses():
+                metric_key = "{}:{}".format(space_key, str(location.name))
+
+                distance_metric = async_metrics.get(location, "ReuseDistance:{}".format(space.data.Source),
+                                                    "ReuseDistance:{}".format(metric_key), unit="blocks")
+                distance_writer = trace_writer.event_writer_from_location(distance_metric.location)
+
+                locality = LocalityStatistics(len(access_seq), block_size, window, start)
+                for t, a in access_seq.get():
+                    distance = locality.add(t, a.address)
+                    if distance is not None:
+                        distance_writer.metric(t, distance_metric.instance, distance)
+                locality.finish()
+
+                working_set_metric = async_metrics.get(location, "WorkingSet:{}".format(space.data.Source),
+                                                       "WorkingSet:{}".format(metric_key), unit="blocks")
+                working_set_writer = trace_writer.event_writer_from_location(working_set_metric.location)
+                for t, size in locality.working_set:
+                    working_set_writer.metric(t, working_set_metric.instance, size)
+
+                summary[space_key][str(location.name)] = locality.to_dict()
+        return summary
+
+
+    def create_metrics(self, trace_writer, clock, options):
+        """
+        Writes the metrics selected in options (MetricOptions).
+        Returns the locality summary, or None without locality metrics.
+        """
+        if options.accesses:
+            self.create_access_metrics(trace_writer, options.every)
+        if options.counters:
+            self.create_counter_metrics(trace_writer, options.every)
+        if options.intervals:
+            interval = max(1, int(options.interval_length * clock.timer_resolution))
+            self.create_interval_metrics(trace_writer, interval, clock.global_offset)
+        if options.locality:
+            window = max(1, int(options.window * clock.timer_resolution))
+            return self.create_locality_metrics(trace_writer, options.block_size, window, clock.global_offset)
+        return None
+
+
+    def get_mapped_spaces(self):
+        """
+        Returns all mapped spaces ordered by address.
+        """
+        return [space.data for space in sorted(self._address_spaces, key=lambda space: space.begin)]
 
 
     def get_space_stats(self):
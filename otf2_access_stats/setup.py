@@ -8,6 +8,7 @@ setup(
         'six',
         'future',
         'intervaltree',
-        'mypy'
+        'mypy',
+        'otf2_pipeline',
     ],
 )
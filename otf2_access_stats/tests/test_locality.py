@@ -0,0 +1,61 @@
+import random
+from collections import Counter
+
+from locality import COLD_MISS, FenwickTree, LocalityStatistics, get_histogram_bin
+
+
+def naive_reuse_distances(blocks):
+    """Distinct blocks between two accesses to the same block by scanning back"""
+    distances = []
+    for i, block in enumerate(blocks):
+        previous = [j for j in range(i) if blocks[j] == block]
+        distances.append(len(set(blocks[previous[-1] + 1:i])) if previous else None)
+    return distances
+
+
+def test_fenwick_tree_matches_list_sums():
+    rng = random.Random(0)
+    values = [0] * 50
+    tree = FenwickTree(len(values))
+    for _ in range(500):
+        index = rng.randrange(len(values))
+        delta = rng.randint(-3, 3)
+        values[index] += delta
+        tree.add(index, delta)
+        end = rng.randrange(len(values) + 1)
+        assert tree.prefix_sum(end) == sum(values[:end])
+
+
+def test_reuse_distances_match_naive_scan():
+    rng = random.Random(1)
+    addresses = [rng.randrange(64 * 30) for _ in range(1000)]
+    stats = LocalityStatistics(len(addresses), 64, 10)
+    distances = [stats.add(t, address) for t, address in enumerate(addresses)]
+    assert distances == naive_reuse_distances([address // 64 for address in addresses])
+
+
+def test_histogram_counts_logarithmic_bins():
+    rng = random.Random(2)
+    addresses = [rng.randrange(4096 * 100) for _ in range(500)]
+    stats = LocalityStatistics(len(addresses), 4096, 10)
+    for t, address in enumerate(addresses):
+        stats.add(t, address)
+    stats.finish()
+    expected = Counter(get_histogram_bin(d) for d in naive_reuse_distances([a // 4096 for a in addresses]))
+    summary = stats.to_dict()
+    assert summary["histogram"] == dict(expected)
+    assert summary["accesses"] == len(addresses)
+    assert summary["distinct_blocks"] == len(set(a // 4096 for a in addresses))
+
+
+def test_histogram_bins():
+    assert get_histogram_bin(None) == COLD_MISS
+    assert [get_histogram_bin(d) for d in (0, 1, 2, 3, 4, 7, 8)] == ["0", "1", "2-3", "2-3", "4-7", "4-7", "8-15"]
+
+
+def test_working_set_drops_to_zero_after_gap():
+    stats = LocalityStatistics(5, 64, 10, start=100)
+    for t, address in [(100, 0), (105, 64), (109, 0), (135, 128), (136, 192)]:
+        stats.add(t, address)
+    stats.finish()
+    assert stats.working_set == [(100, 2), (110, 0), (130, 2)]
@@ -0,0 +1,69 @@
+import itertools
+import random
+
+import pytest
+
+otf2 = pytest.importorskip("otf2")
+pytest.importorskip("intervaltree")
+
+from metricdict import MetricDict
+from parallel import MetricRecorder, balance_locations, write_metric_streams
+
+
+def optimal_makespan(counts, jobs):
+    """Smallest possible maximum shard load by trying every assignment"""
+    best = None
+    for assignment in itertools.product(range(jobs), repeat=len(counts)):
+        loads = [0] * jobs
+        for count, shard in zip(counts, assignment):
+            loads[shard] += count
+        best = max(loads) if best is None else min(best, max(loads))
+    return best
+
+
+def test_every_location_in_exactly_one_shard():
+    event_counts = {i: (i * 37) % 11 + 1 for i in range(20)}
+    shards = balance_locations(event_counts, 4)
+    assert len(shards) == 4
+    assert sorted(i for shard in shards for i in shard) == list(range(20))
+
+
+def test_no_empty_shards_with_few_locations():
+    assert sorted(map(sorted, balance_locations({0: 5, 1: 3}, 8))) == [[0], [1]]
+
+
+def test_makespan_within_greedy_bound():
+    rng = random.Random(0)
+    for _ in range(20):
+        counts = [rng.randint(1, 100) for _ in range(7)]
+        jobs = 3
+        shards = balance_locations(dict(enumerate(counts)), jobs)
+        makespan = max(sum(counts[i] for i in shard) for shard in shards)
+        # Longest processing time first is at most 4/3 - 1/(3 jobs) times the optimum
+        assert makespan <= (4.0 / 3 - 1.0 / (3 * jobs)) * optimal_makespan(counts, jobs)
+
+
+def test_recorded_metric_streams_are_written(tmp_path):
+    trace_file = str(tmp_path / "trace" / "traces.otf2")
+    with otf2.writer.open(str(tmp_path / "trace"), timer_resolution=1000) as trace:
+        root = trace.definitions.system_tree_node("root")
+        group = trace.definitions.location_group("Process", system_tree_parent=root)
+        for i in range(3):
+            trace.definitions.location("Thread {}".format(i), group=group)
+    with otf2.reader.open(trace_file) as trace:
+        locations = list(trace.definitions.locations)
+        recorder = MetricRecorder(trace.definitions)
+        metrics = MetricDict(recorder)
+        for i, location in enumerate(locations[1:], 1):
+            metric = metrics.get(location, "loads", "loads:{}".format(location.name))
+            recorder.event_writer_from_location(metric.location).metric(10 * i, metric.instance, i)
+        streams = recorder.get_streams(locations)
+        assert [stream[:3] for stream in streams] == [("loads:Thread 1", 1, "loads"), ("loads:Thread 2", 2, "loads")]
+        trace_writer = otf2.writer.Writer(str(tmp_path / "rewrite"), definitions=trace.definitions)
+        write_metric_streams(trace_writer, MetricDict(trace_writer), locations, streams)
+        trace_writer.close()
+    with otf2.reader.open(str(tmp_path / "rewrite" / "traces.otf2")) as trace:
+        instances = {instance.recorder.name: instance.scope.name for instance in trace.definitions.metric_instances}
+        assert instances == {"loads:Thread 1": "Thread 1", "loads:Thread 2": "Thread 2"}
+        events = sorted((location.name, event.time, event.values[0]) for location, event in trace.events)
+        assert events == [("loads:Thread 1", 10, 1), ("loads:Thread 2", 20, 2)]
@@ -0,0 +1,43 @@
+import random
+from collections import defaultdict
+
+from spacecollection import Access, AccessSequence, AccessType, IntervalAggregate
+
+
+def naive_aggregate(accesses, interval, start):
+    """Groups the accesses by interval and inserts one empty aggregate per gap"""
+    groups = defaultdict(list)
+    for t, access in accesses:
+        groups[(t - start) // interval].append(access)
+    result = []
+    previous = None
+    for index in sorted(groups):
+        if previous is not None and index > previous + 1:
+            result.append(IntervalAggregate(start + (previous + 1) * interval, 0, 0, None, None))
+        group = groups[index]
+        addresses = [access.address for access in group]
+        result.append(IntervalAggregate(start + index * interval,
+                                        sum(access.type == AccessType.LOAD for access in group),
+                                        sum(access.type == AccessType.STORE for access in group),
+                                        min(addresses), max(addresses)))
+        previous = index
+    return result
+
+
+def test_aggregate_matches_naive_grouping():
+    rng = random.Random(0)
+    accesses = []
+    t = 1000
+    for _ in range(300):
+        # Occasional long jumps leave empty intervals
+        t += rng.choice([1, 2, 3, 50])
+        access_type = rng.choice([AccessType.LOAD, AccessType.STORE])
+        accesses.append((t, Access(rng.randrange(1 << 20), access_type)))
+    sequence = AccessSequence()
+    for t, access in accesses:
+        sequence.add(t, access)
+    assert list(sequence.aggregate(10, 1000)) == naive_aggregate(accesses, 10, 1000)
+
+
+def test_aggregate_of_empty_sequence():
+    assert list(AccessSequence().aggregate(10)) == []
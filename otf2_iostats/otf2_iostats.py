@@ -6,8 +6,13 @@ import collections
 import math
 import json
 import argparse
+import types
+import inspect
+from concurrent.futures import ProcessPoolExecutor
 from intervaltree import Interval, IntervalTree
-from otf2.events import IoOperationBegin
+from otf2.events import IoOperationBegin, IoOperationComplete, IoOperationCancelled
+from otf2_pipeline import Pipeline, Stage, window_ticks
+from otf2_timeindex import load_index
 
 PARADIGM_IDS = {"POSIX", "ISOC"}
 
@@ -26,17 +31,172 @@ class ClockConverter:
 
 class IoStat:
     def __init__(self):
-        self.read_count = 0
-        self.write_count = 0
+        self.counters = collections.defaultdict(int)
+
+    @property
+    def read_count(self) -> int:
+        return self.counters["read"]
+
+    @property
+    def write_count(self) -> int:
+        return self.counters["write"]
+
+    def add(self, name: str, value=1) -> None:
+        self.counters[name] += value
 
     def incReadCount(self) -> None:
-        self.read_count += 1
+        self.add("read")
 
     def incWriteCount(self) -> None:
-        self.write_count += 1
+        self.add("write")
+
+    def merge(self, other: 'IoStat') -> None:
+        for name, value in other.counters.items():
+            self.counters[name] += value
 
     def __str__(self) -> str:
-        return "read_count: {}, write_count: {}".format(self.read_count, self.write_count)
+        return ", ".join("{}: {}".format(name, value) for name, value in sorted(self.counters.items()))
+
+MODE_ENUMS = {"IoOperationBegin": "IoOperationMode", "IoCreateHandle": "IoAccessMode"}
+# Event attribute each predicate reads
+PREDICATE_FIELDS = {"paradigm": "handle", "mode": "mode", "region": "region"}
+
+def event_fields(event_type: type) -> tuple:
+    """Attribute names of an OTF2 event type, i.e. ("time", "region") for Enter"""
+    return tuple(name for name in inspect.signature(event_type.__init__).parameters if name not in ("self", "attributes"))
+
+class CounterSpec:
+    """
+    One counter: the event type it counts, predicates on the event and the aggregation.
+
+    aggregate is "count", "sum" (of the event attribute given by field) or "duration"
+    (seconds spent inside matching regions, for Enter events). Each predicate is a list
+    of accepted values, None accepts everything.
+    """
+
+    AGGREGATIONS = ("count", "sum", "duration")
+
+    def __init__(self, name: str, event: str, aggregate: str = "count", field: str = None,
+                 paradigm: list = None, mode: list = None, region: list = None,
+                 location: list = None, group: list = None):
+        if aggregate not in self.AGGREGATIONS:
+            raise ValueError("Counter {}: unknown aggregation {}".format(name, aggregate))
+        if aggregate == "sum" and not field:
+            raise ValueError("Counter {}: sum needs a field".format(name))
+        if aggregate == "duration" and event != "Enter":
+            raise ValueError("Counter {}: duration is only supported for Enter events".format(name))
+        event_type = getattr(otf2.events, event, None)
+        if not isinstance(event_type, type) or not issubclass(event_type, otf2.events._Event):
+            raise ValueError("Counter {}: unknown event type {}".format(name, event))
+        fields = event_fields(event_type)
+        for predicate, values in (("paradigm", paradigm), ("mode", mode), ("region", region)):
+            if values and PREDICATE_FIELDS[predicate] not in fields:
+                raise ValueError("Counter {}: {} is not supported for {} events".format(name, predicate, event))
+        if mode:
+            if event not in MODE_ENUMS:
+                raise ValueError("Counter {}: mode is not supported for {} events".format(name, event))
+            mode_enum = getattr(otf2.enums, MODE_ENUMS[event])
+            for value in mode:
+                if not hasattr(mode_enum, value):
+                    raise ValueError("Counter {}: unknown {} {}".format(name, MODE_ENUMS[event], value))
+        if field and field not in fields:
+            raise ValueError("Counter {}: {} events have no field {}".format(name, event, field))
+        self.name = name
+        self.event = event
+        self.aggregate = aggregate
+        self.field = field
+        self.paradigm = paradigm
+        self.mode = mode
+        self.region = region
+        self.location = location
+        self.group = group
+
+DEFAULT_COUNTERS = [
+    CounterSpec("read", "IoOperationBegin", paradigm=sorted(PARADIGM_IDS), mode=["READ"]),
+    CounterSpec("write", "IoOperationBegin", paradigm=sorted(PARADIGM_IDS), mode=["WRITE"]),
+]
+
+def load_counter_specs(path: str) -> list:
+    """Reads counter specs from a JSON file of the form {"counters": [{"name": ..., "event": ...}, ...]}"""
+    with open(path) as file:
+        return [CounterSpec(**counter) for counter in json.load(file)["counters"]]
+
+def compile_predicate(spec: CounterSpec):
+    checks = []
+    if spec.paradigm:
+        paradigms = frozenset(spec.paradigm)
+        checks.append(lambda location, event: event.handle.io_paradigm.identification in paradigms)
+    if spec.mode:
+        mode_enum = getattr(otf2.enums, MODE_ENUMS[spec.event])
+        modes = tuple(getattr(mode_enum, mode) for mode in spec.mode)
+        checks.append(lambda location, event: event.mode in modes)
+    if spec.region:
+        regions = frozenset(spec.region)
+        checks.append(lambda location, event: event.region.name in regions)
+    if spec.location:
+        locations = frozenset(spec.location)
+        checks.append(lambda location, event: location.name in locations)
+    if spec.group:
+        groups = frozenset(spec.group)
+        checks.append(lambda location, event: location.group.name in groups)
+    return lambda location, event: all(check(location, event) for check in checks)
+
+class CounterTable:
+    """
+    Counter specs compiled into one dispatch table from event type to handlers,
+    so any number of counters is computed in a single pass.
+    """
+
+    def __init__(self, specs: list, clock: ClockConverter):
+        self.names = [spec.name for spec in specs]
+        self._clock = clock
+        self._handlers = collections.defaultdict(list)
+        self._durations = []
+        self._open_regions = collections.defaultdict(list)
+        for spec in specs:
+            event_type = getattr(otf2.events, spec.event)
+            predicate = compile_predicate(spec)
+            if spec.aggregate == "duration":
+                self._durations.append((spec.name, predicate))
+            else:
+                self._handlers[event_type].append(self._make_handler(spec, predicate))
+        if self._durations:
+            self._handlers[otf2.events.Enter].append(self._enter)
+            self._handlers[otf2.events.Leave].append(self._leave)
+        self.event_types = tuple(self._handlers)
+
+    def _make_handler(self, spec: CounterSpec, predicate):
+        name = spec.name
+        field = spec.field
+        if spec.aggregate == "sum":
+            def handler(location, event, tree):
+                if predicate(location, event):
+                    get_interval(event.time, tree).data.add(name, getattr(event, field))
+        else:
+            def handler(location, event, tree):
+                if predicate(location, event):
+                    get_interval(event.time, tree).data.add(name)
+        return handler
+
+    def _enter(self, location, event, tree) -> None:
+        names = [name for name, predicate in self._durations if predicate(location, event)]
+        self._open_regions[location].append((event.time, names))
+
+    def _leave(self, location, event, tree) -> None:
+        if not self._open_regions[location]:
+            # Entered before the analysed time window
+            return
+        begin, names = self._open_regions[location].pop()
+        if not names:
+            return
+        for interval in tree.search(begin, event.time):
+            overlap = self._clock.to_sec(min(interval.end, event.time) - max(interval.begin, begin))
+            for name in names:
+                interval.data.add(name, overlap)
+
+    def dispatch(self, location, event, tree) -> None:
+        for handler in self._handlers.get(type(event), ()):
+            handler(location, event, tree)
 
 def is_posix(identification: str) -> bool:
     return identification in PARADIGM_IDS
@@ -50,58 +210,305 @@ def get_interval(timestamp: int, tree: IntervalTree) -> Interval:
     assert(len(result) == 1)
     return result[0]
 
-def generate_intervals(trace: otf2.reader.Reader, clock: ClockConverter, length: int) -> tuple:
-    start = clock.properties.global_offset
-    end = start + clock.properties.trace_length
+def generate_intervals(trace: otf2.reader.Reader, start: int, end: int, length: int) -> tuple:
     for loc_group in trace.definitions.location_groups:
         if loc_group.location_group_type == otf2.enums.LocationGroupType.PROCESS:
             yield (loc_group.name, IntervalTree(Interval(i, i + length, IoStat()) for i in range(start, end, length)))
 
-def parse_proc_stats(io_stats: dict) -> dict:
+def parse_proc_stats(io_stats: dict, names: list = ("read", "write")) -> dict:
     for proc in io_stats:
-        proc_stats = {"read": [], "write" : []}
+        proc_stats = {name: [] for name in names}
         for interval in sorted(io_stats[proc]):
-            proc_stats["read"].append(interval.data.read_count)
-            proc_stats["write"].append(interval.data.write_count)
+            for name in names:
+                proc_stats[name].append(interval.data.counters.get(name, 0))
         yield (proc, proc_stats)
 
-def store_stats(io_stats: dict, path: str) -> None:
-    out = {proc: stats for proc, stats in parse_proc_stats(io_stats)}
+def merge_stats(io_stats: dict, other: dict) -> dict:
+    for proc in io_stats:
+        for interval, other_interval in zip(sorted(io_stats[proc]), sorted(other[proc])):
+            interval.data.merge(other_interval.data)
+    return io_stats
+
+def write_stats(out: dict, path: str) -> None:
     with open("{}/io_stats.json".format(path), 'w') as file:
         json.dump(out, file)
 
-def get_io_operation_count(trace_file: str, interval_length: float = None, step_count: int = None) -> dict:
-    with otf2.reader.open(trace_file) as trace:
+def store_stats(io_stats: dict, path: str, names: list = ("read", "write")) -> None:
+    write_stats({proc: stats for proc, stats in parse_proc_stats(io_stats, names)}, path)
+
+def get_interval_grid(clock: ClockConverter, window: tuple, interval_length: float, step_count: int) -> tuple:
+    start, end = window_ticks(clock.properties, window)
+    if start is None:
+        start = clock.properties.global_offset
+    if end is None:
+        end = clock.properties.global_offset + clock.properties.trace_length
+    if interval_length:
+        length = int(clock.to_ticks(interval_length))
+        step_count = int((end - start) / length)
+    else:
+        length = int((end - start) / step_count)
+    return start, end, length, step_count
+
+class IoOperationCountStage(Stage):
+    event_types = (IoOperationBegin,)
+
+    def __init__(self, interval_length: float = None, step_count: int = None, output: str = None,
+                 window: tuple = (None, None), verbose: bool = True, counters: list = DEFAULT_COUNTERS):
+        self.counters = counters
+        self.interval_length = interval_length
+        self.step_count = step_count
+        self.output = output
+        self.window = window
+        self.verbose = verbose
+        self.io_stats = None
+
+    def begin(self, trace: otf2.reader.Reader) -> None:
         clock = ClockConverter(trace.definitions.clock_properties)
-        if interval_length:
-            length = int(clock.to_ticks(interval_length))
-            step_count = int(clock.properties.trace_length / length)
+        start, end, length, step_count = get_interval_grid(clock, self.window, self.interval_length, self.step_count)
+
+        if self.verbose:
+            print("Created {} intervals of length {} secs".format(step_count, clock.to_sec(length)))
+        self.io_stats = {proc: interval for (proc, interval) in generate_intervals(trace, start, end, length)}
+        self.table = CounterTable(self.counters, clock)
+        self.event_types = self.table.event_types
+
+    def process(self, location: otf2.definitions.Location, event) -> None:
+        self.table.dispatch(location, event, self.io_stats[location.group.name])
+
+    def finalize(self) -> dict:
+        if self.output:
+            store_stats(self.io_stats, self.output, self.table.names)
+        return self.io_stats
+
+class ConcurrencyTimeline:
+    """
+    Sweep line over the begin/end points of I/O operations of one process or path.
+    Integrates the in-flight depth per interval and tracks its maximum. Both are only recorded
+    when time advances, so the order of simultaneous begins and completions does not matter.
+    """
+
+    def __init__(self, start: int, end: int, length: int):
+        self.start = start
+        self.end = end
+        self.length = length
+        bins = len(range(start, end, length))
+        self.depth = 0
+        self.last_time = start
+        self.depth_time = [0] * bins
+        self.max_depth = [0] * bins
+
+    def _bin(self, time: int) -> int:
+        return (time - self.start) // self.length
+
+    def advance(self, time: int) -> None:
+        time = min(max(time, self.start), self.end)
+        current = self.last_time
+        while self.depth and current < time:
+            i = self._bin(current)
+            edge = min(time, self.start + (i + 1) * self.length)
+            self.depth_time[i] += self.depth * (edge - current)
+            self.max_depth[i] = max(self.max_depth[i], self.depth)
+            current = edge
+        self.last_time = max(self.last_time, time)
+
+    def change(self, time: int, delta: int) -> None:
+        self.advance(time)
+        self.depth += delta
+
+    def to_dict(self) -> dict:
+        average = []
+        for i, depth_time in enumerate(self.depth_time):
+            begin = self.start + i * self.length
+            average.append(depth_time / (min(begin + self.length, self.end) - begin))
+        return {"avg": average, "max": self.max_depth}
+
+def get_io_path(handle) -> str:
+    if handle.file is not None:
+        return handle.file.name
+    return handle.name
+
+class IoConcurrencyStage(Stage):
+    """
+    Time-weighted average and maximum number of in-flight I/O operations per interval,
+    per process and per file system path. Only the operations in flight are kept in memory.
+    """
+    event_types = (IoOperationBegin, IoOperationComplete, IoOperationCancelled)
+
+    def __init__(self, interval_length: float = None, step_count: int = None, output: str = None,
+                 window: tuple = (None, None), paradigms: set = PARADIGM_IDS):
+        self.interval_length = interval_length
+        self.step_count = step_count
+        self.output = output
+        self.window = window
+        self.paradigms = paradigms
+        self.timelines = None
+
+    def begin(self, trace: otf2.reader.Reader) -> None:
+        clock = ClockConverter(trace.definitions.clock_properties)
+        self._grid = get_interval_grid(clock, self.window, self.interval_length, self.step_count)[:3]
+        self._in_flight = {}
+        self.timelines = {"process": {}, "path": {}}
+
+    def _get_timeline(self, kind: str, key: str) -> ConcurrencyTimeline:
+        timelines = self.timelines[kind]
+        if key not in timelines:
+            timelines[key] = ConcurrencyTimeline(*self._grid)
+        return timelines[key]
+
+    def process(self, location: otf2.definitions.Location, event) -> None:
+        # Matching ids are only unique per handle
+        key = (location, event.handle, event.matching_id)
+        if isinstance(event, IoOperationBegin):
+            if self.paradigms and event.handle.io_paradigm.identification not in self.paradigms:
+                return
+            timelines = (self._get_timeline("process", location.group.name),
+                         self._get_timeline("path", get_io_path(event.handle)))
+            self._in_flight[key] = timelines
+            delta = 1
         else:
-            length = int(clock.properties.trace_length / step_count)
+            # Operations begun before the analysed time window or of other paradigms are not tracked
+            timelines = self._in_flight.pop(key, ())
+            delta = -1
+        for timeline in timelines:
+            timeline.change(event.time, delta)
+
+    def finalize(self) -> dict:
+        end = self._grid[1]
+        out = {}
+        for kind, timelines in self.timelines.items():
+            for timeline in timelines.values():
+                timeline.advance(end)
+            out[kind] = {key: timeline.to_dict() for key, timeline in timelines.items()}
+        if self.output:
+            with open("{}/io_concurrency.json".format(self.output), 'w') as file:
+                json.dump(out, file)
+        return out
+
+def count_chunk(trace_file: str, interval_length: float, step_count: int, window: tuple, chunk: tuple,
+                counters: list) -> dict:
+    """Worker: counts one time chunk, reading from the index checkpoints before the chunk to its end"""
+    stage = IoOperationCountStage(interval_length, step_count, window=window, verbose=False, counters=counters)
+    return Pipeline([stage]).run(trace_file, chunk)[0]
+
+def get_io_operation_count(trace_file: str, interval_length: float = None, step_count: int = None,
+                           window: tuple = (None, None), jobs: int = 1, counters: list = DEFAULT_COUNTERS) -> dict:
+    if jobs > 1 and any(counter.aggregate == "duration" for counter in counters):
+        # Regions spanning a chunk boundary would be lost
+        print("Duration counters need whole regions, counting sequentially.")
+        jobs = 1
+    index = load_index(trace_file) if jobs > 1 else None
+    if jobs > 1 and index is None:
+        print("No time index found, counting sequentially. Create one with otf2_timeindex.py.")
+    if index is None:
+        stage = IoOperationCountStage(interval_length, step_count, window=window, counters=counters)
+        return Pipeline([stage]).run(trace_file, window)[0]
+
+    chunks = index.split(jobs, window)
+    print("Counting {} time chunks in parallel".format(len(chunks)))
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(count_chunk, trace_file, interval_length, step_count, window, chunk, counters) for chunk in chunks]
+        io_stats = futures[0].result()
+        for future in futures[1:]:
+            merge_stats(io_stats, future.result())
+    return io_stats
+
+def column_mask(store, spec: CounterSpec, columns: dict):
+    import numpy
+    mask = numpy.ones(len(columns["time"]), dtype=bool)
+    if spec.paradigm:
+        handles = [i for i, handle in enumerate(store.manifest["io_handles"]) if handle["paradigm"] in spec.paradigm]
+        mask &= numpy.isin(columns["handle"], handles)
+    if spec.mode:
+        mode_enum = getattr(otf2.enums, MODE_ENUMS[spec.event])
+        modes = store.enum_ids(MODE_ENUMS[spec.event], [getattr(mode_enum, mode) for mode in spec.mode])
+        mask &= numpy.isin(columns["mode"], modes)
+    if spec.region:
+        regions = [i for i, name in enumerate(store.manifest["regions"]) if name in spec.region]
+        mask &= numpy.isin(columns["region"], regions)
+    return mask
 
-        print("Created {} intervals of length {} secs".format(step_count, clock.to_sec(length)))
-        io_stats = {proc: interval for (proc, interval) in generate_intervals(trace, clock, length)}
+def get_io_operation_count_from_columns(columns_path: str, interval_length: float = None, step_count: int = None,
+                                        window: tuple = (None, None), counters: list = DEFAULT_COUNTERS) -> dict:
+    """Computes the counters with array operations on columns exported by otf2_columns.py"""
+    import numpy
+    from otf2_columns import ColumnStore
+    store = ColumnStore(columns_path)
+    properties = {key: store.manifest[key] for key in ("timer_resolution", "global_offset", "trace_length")}
+    clock = ClockConverter(types.SimpleNamespace(**properties))
+    start, end, length, step_count = get_interval_grid(clock, window, interval_length, step_count)
+    bins = len(range(start, end, length))
+    print("Created {} intervals of length {} secs".format(step_count, clock.to_sec(length)))
 
-        for location, event in trace.events:
-            if isinstance(event, IoOperationBegin) and is_posix(event.handle.io_paradigm.identification):
-                if event.mode == otf2.enums.IoOperationMode.WRITE:
-                    tree = io_stats[location.group.name]
-                    get_interval(event.time, tree).data.incWriteCount()
-                if event.mode == otf2.enums.IoOperationMode.READ:
-                    tree = io_stats[location.group.name]
-                    get_interval(event.time, tree).data.incReadCount()
+    stats = {}
+    for i, location in enumerate(store.locations):
+        if not location["process"]:
+            continue
+        proc_stats = stats.setdefault(location["group"], {counter.name: numpy.zeros(bins, dtype=numpy.int64)
+                                                          for counter in counters})
+        for spec in counters:
+            if spec.aggregate == "duration":
+                raise ValueError("Counter {}: duration is not supported for column input".format(spec.name))
+            if spec.location and location["name"] not in spec.location:
+                continue
+            if spec.group and location["group"] not in spec.group:
+                continue
+            columns = store.columns(i, spec.event)
+            mask = column_mask(store, spec, columns)
+            times = columns["time"][mask].astype(numpy.int64)
+            # Like window_events, an open window keeps the events at the end of the trace
+            valid = times >= start
+            if window[1] is not None:
+                valid &= times < end
+            index = (times[valid] - start) // length
+            in_grid = index < bins
+            index = index[in_grid]
+            if spec.aggregate != "sum":
+                proc_stats[spec.name] += numpy.bincount(index, minlength=bins)[:bins]
+                continue
+            weights = columns[spec.field][mask][valid][in_grid]
+            if numpy.issubdtype(weights.dtype, numpy.integer):
+                # bincount sums in float64, integer fields are summed exactly as in the trace path
+                numpy.add.at(proc_stats[spec.name], index, weights.astype(numpy.int64))
+            else:
+                proc_stats[spec.name] = proc_stats[spec.name] + numpy.bincount(index, weights=weights, minlength=bins)[:bins]
 
-        return io_stats
+    for proc_stats in stats.values():
+        for counter in counters:
+            proc_stats[counter.name] = proc_stats[counter.name].tolist()
+    return stats
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("trace", help="Path to trace file i.e. trace.otf2", type=str)
+    parser.add_argument("trace", help="Path to trace file i.e. trace.otf2, or to a column directory with --columns", type=str)
     parser.add_argument("output", help="Path to output directory", type=str)
     parser.add_argument("--num_intervals", help="Number of intervals in which the trace will be cutted.", type=int, default=10)
     parser.add_argument("--interval_length", help="Specifies the length of an interval in seconds(float).", type=float)
+    parser.add_argument("--begin", help="Start of the analysed time window in seconds(float) since the trace start.", type=float)
+    parser.add_argument("--end", help="End of the analysed time window in seconds(float) since the trace start.", type=float)
+    parser.add_argument("--jobs", help="Number of worker processes, each counting a time chunk given by the time index.", type=int, default=1)
+    parser.add_argument("--counters", help="JSON file with counter specs, defaults to read/write counts of POSIX/ISOC operations.", type=str)
+    parser.add_argument("--concurrency", action="store_true", help="Also writes the average and maximum number of in-flight operations per interval, process and path.")
+    parser.add_argument("--columns", action="store_true", help="Read the column files exported by otf2_columns.py instead of a trace.")
     args = parser.parse_args()
 
     if not os.path.exists(args.output):
         sys.exit("Given path does not exist.")
-    io_stats = get_io_operation_count(args.trace, args.interval_length, args.num_intervals)
-    store_stats(io_stats, args.output)
+    counters = load_counter_specs(args.counters) if args.counters else DEFAULT_COUNTERS
+    if args.concurrency and args.columns:
+        sys.exit("--concurrency needs a trace as input.")
+    if args.columns:
+        out = get_io_operation_count_from_columns(args.trace, args.interval_length, args.num_intervals,
+                                                  (args.begin, args.end), counters)
+        write_stats(out, args.output)
+    elif args.concurrency:
+        if args.jobs > 1:
+            print("Computing the concurrency timeline sequentially.")
+        window = (args.begin, args.end)
+        stages = [IoOperationCountStage(args.interval_length, args.num_intervals, output=args.output,
+                                        window=window, counters=counters),
+                  IoConcurrencyStage(args.interval_length, args.num_intervals, output=args.output, window=window)]
+        Pipeline(stages).run(args.trace, window)
+    else:
+        io_stats = get_io_operation_count(args.trace, args.interval_length, args.num_intervals,
+                                          (args.begin, args.end), args.jobs, counters)
+        store_stats(io_stats, args.output, [counter.name for counter in counters])
@@ -9,5 +9,6 @@ setup(
         'intervaltree',
         'six',
         'future',
+        'otf2_pipeline',
     ],
 )
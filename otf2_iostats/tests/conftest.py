@@ -0,0 +1,7 @@
+import os.path
+import sys
+
+# The scripts import each other by module name
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "otf2_pipeline"))
@@ -0,0 +1,90 @@
+import random
+import types
+
+import pytest
+
+otf2 = pytest.importorskip("otf2")
+pytest.importorskip("intervaltree")
+
+from otf2.events import IoOperationBegin, IoOperationComplete
+from otf2_iostats import ConcurrencyTimeline, IoConcurrencyStage
+
+
+def naive_concurrency(operations, start, end, length):
+    """Depth at every tick, averaged and maximized per interval"""
+    average, maximum = [], []
+    for begin in range(start, end, length):
+        depths = [sum(1 for b, e in operations if b <= t < e) for t in range(begin, min(begin + length, end))]
+        average.append(sum(depths) / len(depths))
+        maximum.append(max(depths))
+    return average, maximum
+
+
+def sweep(operations, start, end, length, rng):
+    timeline = ConcurrencyTimeline(start, end, length)
+    points = [(b, 1) for b, _ in operations] + [(e, -1) for _, e in operations]
+    # Simultaneous begins and completions in any order
+    rng.shuffle(points)
+    points.sort(key=lambda p: p[0])
+    for time, delta in points:
+        timeline.change(time, delta)
+    timeline.advance(end)
+    return timeline.to_dict()
+
+
+def test_timeline_matches_naive_depths():
+    rng = random.Random(0)
+    for _ in range(20):
+        operations = []
+        for _ in range(30):
+            begin = rng.randrange(0, 200)
+            operations.append((begin, begin + rng.randint(1, 40)))
+        average, maximum = naive_concurrency(operations, 50, 190, 25)
+        result = sweep(operations, 50, 190, 25, rng)
+        assert result["avg"] == pytest.approx(average)
+        assert result["max"] == maximum
+
+
+class Handle:
+    def __init__(self, name):
+        self.name = name
+        self.file = None
+        self.io_paradigm = types.SimpleNamespace(identification="POSIX")
+
+
+class Location:
+    group = types.SimpleNamespace(name="Process")
+
+
+def test_matching_ids_are_scoped_by_handle():
+    clock = types.SimpleNamespace(global_offset=0, timer_resolution=1, trace_length=100)
+    trace = types.SimpleNamespace(definitions=types.SimpleNamespace(clock_properties=clock))
+    location = Location()
+    stage = IoConcurrencyStage(step_count=4)
+    stage.begin(trace)
+    a, b = Handle("a"), Handle("b")
+    mode, flags = otf2.enums.IoOperationMode.READ, otf2.enums.IoOperationFlag.NONE
+    for event in [IoOperationBegin(0, a, mode, flags, 1, 7), IoOperationBegin(10, b, mode, flags, 1, 7),
+                  IoOperationComplete(20, b, 1, 7), IoOperationComplete(30, a, 1, 7)]:
+        stage.process(location, event)
+    result = stage.finalize()["process"]["Process"]
+    assert result["max"] == [2, 1, 0, 0]
+    assert result["avg"] == pytest.approx([1.4, 0.2, 0, 0])
+
+
+def test_begin_before_simultaneous_complete():
+    clock = types.SimpleNamespace(global_offset=0, timer_resolution=1, trace_length=100)
+    trace = types.SimpleNamespace(definitions=types.SimpleNamespace(clock_properties=clock))
+    location = Location()
+    stage = IoConcurrencyStage(step_count=4)
+    stage.begin(trace)
+    a, b = Handle("a"), Handle("b")
+    mode, flags = otf2.enums.IoOperationMode.READ, otf2.enums.IoOperationFlag.NONE
+    # b begins at the time a completes, so both are never in flight at once
+    for event in [IoOperationBegin(0, a, mode, flags, 1, 1), IoOperationBegin(10, b, mode, flags, 1, 2),
+                  IoOperationComplete(10, a, 1, 1), IoOperationComplete(20, b, 1, 2)]:
+        stage.process(location, event)
+    result = stage.finalize()
+    for kind, key in (("process", "Process"), ("path", "a")):
+        assert result[kind][key]["max"][0] == 1
+    assert result["process"]["Process"]["avg"] == pytest.approx([0.8, 0, 0, 0])
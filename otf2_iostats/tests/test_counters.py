@@ -0,0 +1,77 @@
+import types
+
+import pytest
+
+otf2 = pytest.importorskip("otf2")
+pytest.importorskip("intervaltree")
+
+from intervaltree import Interval, IntervalTree
+from otf2.events import Enter, IoOperationBegin, Leave
+from otf2_iostats import ClockConverter, CounterSpec, CounterTable, IoStat
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    (dict(event="IoOperationBegun"), "unknown event type"),
+    (dict(event="IoOperationBegin", aggregate="max"), "unknown aggregation"),
+    (dict(event="IoOperationBegin", aggregate="sum"), "sum needs a field"),
+    (dict(event="IoOperationBegin", aggregate="sum", field="bytes"), "no field bytes"),
+    (dict(event="IoOperationBegin", mode=["APPEND"]), "unknown IoOperationMode APPEND"),
+    (dict(event="IoOperationBegin", region=["MPI_Wait"]), "region is not supported"),
+    (dict(event="Enter", paradigm=["POSIX"]), "paradigm is not supported"),
+    (dict(event="IoOperationComplete", mode=["READ"]), "mode is not supported"),
+    (dict(event="IoOperationBegin", aggregate="duration"), "only supported for Enter"),
+])
+def test_invalid_specs_are_rejected(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        CounterSpec("counter", **kwargs)
+
+
+class Handle:
+    def __init__(self, paradigm):
+        self.io_paradigm = types.SimpleNamespace(identification=paradigm)
+
+
+class Location:
+    name = "Thread 0"
+    group = types.SimpleNamespace(name="Process")
+
+
+def make_grid(start, end, length):
+    return IntervalTree(Interval(i, i + length, IoStat()) for i in range(start, end, length))
+
+
+def counts(tree, name):
+    return [interval.data.counters.get(name, 0) for interval in sorted(tree)]
+
+
+def make_table(specs, timer_resolution=1):
+    clock = types.SimpleNamespace(global_offset=0, timer_resolution=timer_resolution, trace_length=40)
+    return CounterTable(specs, ClockConverter(clock))
+
+
+def test_count_and_sum_per_interval():
+    table = make_table([CounterSpec("reads", "IoOperationBegin", paradigm=["POSIX"], mode=["READ"]),
+                        CounterSpec("bytes_read", "IoOperationBegin", aggregate="sum", field="bytes_request",
+                                    mode=["READ"])])
+    tree = make_grid(0, 40, 10)
+    read, write = otf2.enums.IoOperationMode.READ, otf2.enums.IoOperationMode.WRITE
+    flags = otf2.enums.IoOperationFlag.NONE
+    location, posix, isoc = Location(), Handle("POSIX"), Handle("ISOC")
+    for time, handle, mode, size in [(0, posix, read, 100), (9, posix, read, 20), (10, posix, write, 7),
+                                     (15, isoc, read, 3), (39, posix, read, 1)]:
+        table.dispatch(location, IoOperationBegin(time, handle, mode, flags, size, 0), tree)
+    assert counts(tree, "reads") == [2, 0, 0, 1]
+    assert counts(tree, "bytes_read") == [120, 3, 0, 1]
+
+
+def test_duration_is_split_at_interval_boundaries():
+    table = make_table([CounterSpec("wait", "Enter", aggregate="duration", region=["MPI_Wait"])], timer_resolution=10)
+    tree = make_grid(0, 40, 10)
+    location = Location()
+    wait, work = types.SimpleNamespace(name="MPI_Wait"), types.SimpleNamespace(name="work")
+    # A Leave without its Enter (entered before the window) is ignored
+    events = [Leave(1, work), Enter(5, wait), Enter(8, work), Leave(12, work), Leave(27, wait),
+              Enter(30, work), Leave(35, work)]
+    for event in events:
+        table.dispatch(location, event, tree)
+    assert counts(tree, "wait") == pytest.approx([0.5, 1.0, 0.7, 0])
@@ -0,0 +1,230 @@
+#! /usr/bin/env python3
+import sys
+import os.path
+import argparse
+import array
+import json
+import struct
+import otf2
+
+from otf2_pipeline import Pipeline, Stage
+
+MANIFEST = "columns.json"
+FLUSH_SIZE = 1 << 16
+# Pseudo event type of the address spaces mapped by events with mmap attributes (see otf2_access_stats)
+MMAP = "Mmap"
+
+# Columns per event type as (name, array typecode). References are stored as indices
+# into the definition tables of the manifest.
+SCHEMAS = {
+    "Enter": (("time", "Q"), ("region", "i")),
+    "Leave": (("time", "Q"), ("region", "i")),
+    "IoOperationBegin": (("time", "Q"), ("handle", "i"), ("mode", "i"), ("bytes_request", "Q"), ("matching_id", "Q")),
+    "IoOperationComplete": (("time", "Q"), ("handle", "i"), ("bytes_result", "Q"), ("matching_id", "Q")),
+    # value holds the raw 64 bits, see ColumnStore.metric_values
+    "Metric": (("time", "Q"), ("member", "i"), ("value", "Q")),
+    # source is an index into the sources of the manifest
+    MMAP: (("time", "Q"), ("address", "Q"), ("size", "Q"), ("source", "i")),
+}
+DEFAULT_EVENTS = tuple(name for name in SCHEMAS if name != MMAP)
+
+
+def numpy_dtype(typecode):
+    """NumPy dtype string of an array typecode in native byte order, i.e. "Q" -> "<u8" """
+    kind = {"Q": "u", "q": "i", "i": "i", "d": "f"}[typecode]
+    order = "<" if sys.byteorder == "little" else ">"
+    return "{}{}{}".format(order, kind, array.array(typecode).itemsize)
+
+
+def raw_bits(value):
+    """The 64 bit pattern of an int or float metric value"""
+    if isinstance(value, float):
+        return struct.unpack("<Q", struct.pack("<d", value))[0]
+    return value & 0xFFFFFFFFFFFFFFFF
+
+
+class ColumnWriter(object):
+    """Buffers the columns of one event type of one location and appends them to raw files"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.count = 0
+        self._names = [name for name, _ in schema]
+        self._buffers = [array.array(typecode) for _, typecode in schema]
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def append(self, row):
+        for buffer, value in zip(self._buffers, row):
+            buffer.append(value)
+        self.count += 1
+        if len(self._buffers[0]) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        for name, buffer in zip(self._names, self._buffers):
+            with open(os.path.join(self.path, name + ".bin"), 'ab') as file:
+                buffer.tofile(file)
+            del buffer[:]
+
+
+class ColumnExportStage(Stage):
+    """
+    Writes the selected event types per location into typed column files.
+
+    Layout: <output>/<location index>/<event type>/<column>.bin plus a manifest
+    with the dtypes, row counts and the definition tables the references point to.
+    The Mmap pseudo event type holds the address spaces mapped by any event.
+    """
+
+    def __init__(self, output, events=DEFAULT_EVENTS):
+        for name in events:
+            if name not in SCHEMAS:
+                raise ValueError("No column schema for {} events".format(name))
+        self.output = output
+        self._names = list(events)
+        self._event_names = {getattr(otf2.events, name): name for name in events if name != MMAP}
+        self._mmap = MMAP in events
+        # Mmap attributes may be attached to any event
+        self.event_types = (otf2.events._Event,) if self._mmap else tuple(self._event_names)
+
+    def begin(self, trace):
+        definitions = trace.definitions
+        self._definitions = definitions
+        if self._mmap:
+            # Needs otf2_access_stats on the path, like the --access option of otf2_pipeline.py
+            from eventclassifier import EventClassifier
+            self._classifier = EventClassifier(definitions)
+        self._locations = {location: i for i, location in enumerate(definitions.locations)}
+        self._regions = {region: i for i, region in enumerate(definitions.regions)}
+        self._handles = {handle: i for i, handle in enumerate(definitions.io_handles)}
+        self._members = {member: i for i, member in enumerate(definitions.metric_members)}
+        self._enums = {}
+        self._sources = {}
+        self._writers = {}
+
+    def _enum_id(self, value):
+        table = self._enums.setdefault(type(value).__name__, {})
+        return table.setdefault(value, len(table))
+
+    def _rows(self, name, event):
+        if name in ("Enter", "Leave"):
+            yield (event.time, self._regions[event.region])
+        elif name == "IoOperationBegin":
+            yield (event.time, self._handles[event.handle], self._enum_id(event.mode),
+                   event.bytes_request, event.matching_id)
+        elif name == "IoOperationComplete":
+            yield (event.time, self._handles[event.handle], event.bytes_result, event.matching_id)
+        elif name == "Metric":
+            metric_class = getattr(event.metric, "metric_class", event.metric)
+            for member, value in zip(metric_class.members, event.values):
+                yield (event.time, self._members[member], raw_bits(value))
+
+    def _append(self, location, name, rows):
+        key = (self._locations[location], name)
+        writer = self._writers.get(key)
+        if writer is None:
+            path = os.path.join(self.output, str(key[0]), name)
+            writer = self._writers[key] = ColumnWriter(path, SCHEMAS[name])
+        for row in rows:
+            writer.append(row)
+
+    def process(self, location, event):
+        name = self._event_names.get(type(event))
+        if name is not None:
+            self._append(location, name, self._rows(name, event))
+        if self._mmap:
+            space = self._classifier.mapped_space(event)
+            if space is not None:
+                source = self._sources.setdefault(space.Source, len(self._sources))
+                self._append(location, MMAP, ((event.time, space.Address, space.Size, source),))
+
+    def finalize(self):
+        for writer in self._writers.values():
+            writer.flush()
+        definitions = self._definitions
+        clock = definitions.clock_properties
+        locations = [{"name": location.name,
+                      "group": location.group.name,
+                      "process": location.group.location_group_type == otf2.enums.LocationGroupType.PROCESS,
+                      "events": {}}
+                     for location in definitions.locations]
+        for (location, name), writer in self._writers.items():
+            locations[location]["events"][name] = writer.count
+        manifest = {
+            "timer_resolution": clock.timer_resolution,
+            "global_offset": clock.global_offset,
+            "trace_length": clock.trace_length,
+            "schemas": {name: {column: numpy_dtype(typecode) for column, typecode in SCHEMAS[name]}
+                        for name in self._names},
+            "locations": locations,
+            "regions": [region.name for region in definitions.regions],
+            "io_handles": [{"name": handle.name,
+                            "paradigm": handle.io_paradigm.identification,
+                            "file": handle.file.name if handle.file is not None else None}
+                           for handle in definitions.io_handles],
+            "metric_members": [{"name": member.name, "unit": member.unit, "value_type": str(member.value_type)}
+                               for member in definitions.metric_members],
+            "sources": sorted(self._sources, key=self._sources.get),
+            "enums": {name: [str(value) for value, _ in sorted(table.items(), key=lambda item: item[1])]
+                      for name, table in self._enums.items()},
+        }
+        with open(os.path.join(self.output, MANIFEST), 'w') as file:
+            json.dump(manifest, file)
+        return manifest
+
+
+class ColumnStore(object):
+    """Memory-maps the column files written by ColumnExportStage"""
+
+    def __init__(self, path):
+        import numpy
+        self._numpy = numpy
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as file:
+            self.manifest = json.load(file)
+        self.locations = self.manifest["locations"]
+
+    def columns(self, location, event):
+        """Dict of column name -> read-only array of one event type of one location"""
+        numpy = self._numpy
+        count = self.locations[location]["events"].get(event, 0)
+        schema = self.manifest["schemas"].get(event)
+        if schema is None:
+            raise ValueError("{} events were not exported".format(event))
+        result = {}
+        for column, dtype in schema.items():
+            if count == 0:
+                result[column] = numpy.empty(0, dtype=dtype)
+            else:
+                path = os.path.join(self.path, str(location), event, column + ".bin")
+                result[column] = numpy.memmap(path, dtype=dtype, mode='r', shape=(count,))
+        return result
+
+    def enum_ids(self, enum_name, values):
+        """Ids of the given enum values (compared by their string) in the exported columns"""
+        names = self.manifest["enums"].get(enum_name, [])
+        wanted = set(str(value) for value in values)
+        return [i for i, name in enumerate(names) if name in wanted]
+
+    def metric_values(self, columns, member):
+        """Values of one metric member, as float64 for DOUBLE members and uint64 otherwise"""
+        values = columns["value"][columns["member"] == member]
+        if self.manifest["metric_members"][member]["value_type"].endswith("DOUBLE"):
+            return values.view("<f8" if sys.byteorder == "little" else ">f8")
+        return values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export OTF2 events into memory-mappable column files")
+    parser.add_argument("trace", help="Path to trace file i.e. trace.otf2", type=str)
+    parser.add_argument("output", help="Path to output directory, should be empty", type=str)
+    parser.add_argument("--events", nargs="+", choices=sorted(SCHEMAS), default=sorted(DEFAULT_EVENTS),
+                        help="Event types to export. Mmap needs otf2_access_stats on the PYTHONPATH.")
+    parser.add_argument("--begin", help="Start of the exported time window in seconds(float) since the trace start.", type=float)
+    parser.add_argument("--end", help="End of the exported time window in seconds(float) since the trace start.", type=float)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.output, MANIFEST)):
+        sys.exit("Output directory already contains exported columns.")
+    Pipeline([ColumnExportStage(args.output, args.events)]).run(args.trace, (args.begin, args.end))
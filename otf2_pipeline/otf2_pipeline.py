@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+import sys
+import os.path
+import argparse
+import otf2
+
+
+def window_ticks(clock_properties, window):
+    """Converts a (begin, end) window in seconds since the trace start into timestamps. None stays open."""
+    def to_ticks(secs):
+        if secs is None:
+            return None
+        return clock_properties.global_offset + int(secs * clock_properties.timer_resolution)
+    return tuple(to_ticks(secs) for secs in window)
+
+
+def window_events(events, begin=None, end=None):
+    """
+    Yields the (location, event) pairs with begin <= time < end.
+    The events are expected in time order, so reading stops at the first event past the window.
+    """
+    for location, event in events:
+        if end is not None and event.time >= end:
+            break
+        if begin is None or event.time >= begin:
+            yield location, event
+
+
+class Stage(object):
+    """
+    Base class of a pipeline stage.
+
+    A stage only receives events that are instances of one of its event_types.
+    process() may return False to drop the event for all following stages.
+    """
+
+    event_types = ()
+
+    def begin(self, trace):
+        pass
+
+    def process(self, location, event):
+        pass
+
+    def finalize(self):
+        return None
+
+
+class Pipeline(object):
+    """
+    Reads a trace once and dispatches each event to the stages registered for its type.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._dispatch = {}
+
+    def _get_stages(self, event_type):
+        stages = self._dispatch.get(event_type)
+        if stages is None:
+            stages = [stage for stage in self.stages if issubclass(event_type, stage.event_types)]
+            self._dispatch[event_type] = stages
+        return stages
+
+    def dispatch(self, location, event):
+        """Passes the event through its stages. Returns False if a stage dropped it."""
+        for stage in self._get_stages(type(event)):
+            if stage.process(location, event) is False:
+                return False
+        return True
+
+    def run_events(self, events):
+        """Dispatches all (location, event) pairs and returns the results of the finalizers"""
+        dispatch = self.dispatch
+        for location, event in events:
+            dispatch(location, event)
+        return [stage.finalize() for stage in self.stages]
+
+    def run(self, trace_file, window=None):
+        """
+        Runs all stages over the trace, restricted to a (begin, end) window in seconds if given.
+        With a time index the reading starts at the checkpoints before the window.
+        """
+        with otf2.reader.open(trace_file) as trace:
+            for stage in self.stages:
+                stage.begin(trace)
+            events = trace.events
+            if window is not None:
+                # Imported here as otf2_timeindex builds on this module
+                from otf2_timeindex import load_index, seek_events
+                events = seek_events(trace, load_index(trace_file), window[0])
+                events = window_events(events, *window_ticks(trace.definitions.clock_properties, window))
+            return self.run_events(events)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several analyses in one pass over a trace")
+    parser.add_argument("trace", help="Path to trace file i.e. trace.otf2", type=str)
+    parser.add_argument("--iostats", help="Output directory of the I/O statistics (otf2_iostats).", type=str)
+    parser.add_argument("--num_intervals", help="Number of intervals in which the trace will be cutted.", type=int, default=10)
+    parser.add_argument("--interval_length", help="Specifies the length of an interval in seconds(float).", type=float)
+    parser.add_argument("--access", action="append", default=[],
+                        choices=["accesses", "counters", "intervals", "locality"],
+                        help="Memory access metrics to create (otf2_access_stats), may be given multiple times.")
+    args = parser.parse_args()
+
+    stages = []
+    if args.iostats:
+        if not os.path.exists(args.iostats):
+            sys.exit("Given path does not exist.")
+        from otf2_iostats import IoOperationCountStage
+        stages.append(IoOperationCountStage(args.interval_length, args.num_intervals, output=args.iostats))
+    if args.access:
+        from create_access_counters import AccessStatisticsStage
+        options = {name: True for name in args.access}
+        if args.interval_length:
+            options["interval_length"] = args.interval_length
+        stages.append(AccessStatisticsStage(args.trace, **options))
+    if not stages:
+        sys.exit("No analysis selected.")
+    Pipeline(stages).run(args.trace)
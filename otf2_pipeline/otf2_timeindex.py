@@ -0,0 +1,175 @@
+#! /usr/bin/env python3
+import sys
+import os.path
+import argparse
+import bisect
+import json
+import otf2
+import _otf2
+
+from otf2_pipeline import Pipeline, Stage
+
+INDEX_SUFFIX = ".tidx"
+DEFAULT_STEP = 10000
+
+
+def index_path(trace_file):
+    """Path of the sidecar index next to the anchor file, i.e. traces.otf2 -> traces.tidx"""
+    return os.path.splitext(trace_file)[0] + INDEX_SUFFIX
+
+
+class TimeIndex(object):
+    """
+    Checkpoints (timestamp -> event position) taken every `step` events per location.
+
+    Locations are identified by their position in the definitions. Public times
+    are seconds since the trace start, as used by the --interval_length options.
+    """
+
+    def __init__(self, step, timer_resolution, global_offset, locations):
+        self.step = step
+        self.timer_resolution = timer_resolution
+        self.global_offset = global_offset
+        # One dict per location: name, events, last_time, times, positions
+        self.locations = locations
+
+    def _to_sec(self, ticks):
+        return (ticks - self.global_offset) / float(self.timer_resolution)
+
+    def position(self, location, secs):
+        """Position of the last checkpoint of the location at or before secs"""
+        loc = self.locations[location]
+        ticks = self.global_offset + int(secs * self.timer_resolution)
+        i = bisect.bisect_right(loc["times"], ticks)
+        return loc["positions"][i - 1] if i > 0 else 0
+
+    def matches(self, definitions):
+        """True if the index was built for a trace with the same locations and event counts"""
+        locations = list(definitions.locations)
+        return len(locations) == len(self.locations) and \
+            all(loc["events"] == location.number_of_events for loc, location in zip(self.locations, locations))
+
+    def overlaps(self, window):
+        """True if any location has events within the (begin, end) window"""
+        begin, end = window
+        for loc in self.locations:
+            if not loc["times"]:
+                continue
+            if (begin is None or self._to_sec(loc["last_time"]) >= begin) and \
+               (end is None or self._to_sec(loc["times"][0]) < end):
+                return True
+        return False
+
+    def split(self, chunks, window=(None, None)):
+        """
+        Splits the window into at most `chunks` consecutive (begin, end) windows
+        holding a similar number of events over all locations.
+        """
+        begin, end = window
+        times = sorted(self._to_sec(t) for loc in self.locations for t in loc["times"]
+                       if (begin is None or self._to_sec(t) >= begin) and (end is None or self._to_sec(t) < end))
+        bounds = [begin]
+        for i in range(1, chunks):
+            if times:
+                bound = times[len(times) * i // chunks]
+                if bounds[-1] is None or bound > bounds[-1]:
+                    bounds.append(bound)
+        bounds.append(end)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({"step": self.step,
+                       "timer_resolution": self.timer_resolution,
+                       "global_offset": self.global_offset,
+                       "locations": self.locations}, file)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            index = json.load(file)
+        return cls(index["step"], index["timer_resolution"], index["global_offset"], index["locations"])
+
+
+def load_index(trace_file):
+    """Returns the TimeIndex of the trace or None if no sidecar index exists"""
+    path = index_path(trace_file)
+    if not os.path.exists(path):
+        return None
+    return TimeIndex.load(path)
+
+
+def seek_events(trace, index, begin, locations=None):
+    """
+    Selects the events of the given locations (all if None) of an opened trace and, given an index,
+    positions the event reader of each location at its last checkpoint at or before begin (seconds).
+    Events before begin may still follow, so the window has to be filtered as usual.
+    Has to be called before the events of the trace are read.
+    """
+    definitions = trace.definitions
+    if locations is None:
+        locations = list(definitions.locations)
+    if index is not None and begin is not None:
+        if not index.matches(definitions):
+            raise ValueError("The time index does not match the trace, rebuild it with otf2_timeindex.py.")
+        location_index = {location: i for i, location in enumerate(definitions.locations)}
+        handle = trace.handle
+        for location in locations:
+            _otf2.Reader_SelectLocation(handle, location._ref)
+        try:
+            _otf2.Reader_OpenEvtFiles(handle)
+        except _otf2.Error:
+            pass
+        for location in locations:
+            evt_reader = _otf2.Reader_GetEvtReader(handle, location._ref)
+            # Seek positions count from 1
+            _otf2.EvtReader_Seek(evt_reader, index.position(location_index[location], begin) + 1)
+    return trace.events(locations)
+
+
+class TimeIndexStage(Stage):
+    """Records a checkpoint for every `step`-th event of each location"""
+    event_types = (otf2.events._Event,)
+
+    def __init__(self, step=DEFAULT_STEP):
+        self.step = step
+
+    def begin(self, trace):
+        clock = trace.definitions.clock_properties
+        self._clock = clock
+        self._location_index = {}
+        self._locations = []
+        for i, location in enumerate(trace.definitions.locations):
+            self._location_index[location] = i
+            self._locations.append({"name": location.name, "events": 0, "last_time": None,
+                                    "times": [], "positions": []})
+
+    def process(self, location, event):
+        loc = self._locations[self._location_index[location]]
+        if loc["events"] % self.step == 0:
+            loc["times"].append(event.time)
+            loc["positions"].append(loc["events"])
+        loc["events"] += 1
+        loc["last_time"] = event.time
+
+    def finalize(self):
+        return TimeIndex(self.step, self._clock.timer_resolution, self._clock.global_offset, self._locations)
+
+
+def build_index(trace_file, step=DEFAULT_STEP):
+    """Reads the trace once and writes the sidecar index"""
+    index = Pipeline([TimeIndexStage(step)]).run(trace_file)[0]
+    index.save(index_path(trace_file))
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a sidecar time index for an OTF2 trace")
+    parser.add_argument("trace", help="Path to trace file i.e. trace.otf2", type=str)
+    parser.add_argument("--step", help="Number of events between two checkpoints of a location.", type=int, default=DEFAULT_STEP)
+    args = parser.parse_args()
+
+    if args.step < 1:
+        sys.exit("--step must be at least 1.")
+    build_index(args.trace, args.step)
+    print("Wrote {}".format(index_path(args.trace)))
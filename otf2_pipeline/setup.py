@@ -0,0 +1,13 @@
+from setuptools import setup
+
+setup(
+    name='otf2_pipeline',
+    version='0.1',
+    py_modules=['otf2_pipeline', 'otf2_timeindex', 'otf2_columns'],
+    install_requires=[
+        'future',
+    ],
+    extras_require={
+        'columns': ['numpy'],
+    },
+)
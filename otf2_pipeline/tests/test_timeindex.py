@@ -0,0 +1,89 @@
+import bisect
+import random
+
+import pytest
+
+otf2 = pytest.importorskip("otf2")
+
+from otf2_pipeline import Pipeline, Stage
+from otf2_timeindex import TimeIndex, build_index, seek_events
+
+
+def make_index(times_per_location, step=1, timer_resolution=1, global_offset=0):
+    locations = [{"name": str(i), "events": len(times) * step, "last_time": times[-1] if times else None,
+                  "times": times, "positions": [j * step for j in range(len(times))]}
+                 for i, times in enumerate(times_per_location)]
+    return TimeIndex(step, timer_resolution, global_offset, locations)
+
+
+def test_split_balances_checkpoints():
+    rng = random.Random(0)
+    times = rng.sample(range(100000), 900)
+    index = make_index([sorted(times[:300]), sorted(times[300:800]), sorted(times[800:])])
+    chunks = index.split(4)
+    assert len(chunks) == 4
+    assert chunks[0][0] is None and chunks[-1][1] is None
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    counts = [sum(1 for t in times if (begin is None or t >= begin) and (end is None or t < end))
+              for begin, end in chunks]
+    assert counts == [225] * 4
+
+
+def test_split_within_window():
+    index = make_index([list(range(0, 100, 2)), list(range(1, 100, 2))])
+    chunks = index.split(3, (10, 70))
+    assert chunks[0][0] == 10 and chunks[-1][1] == 70
+    counts = [sum(1 for t in range(100) if begin <= t < end) for begin, end in chunks]
+    assert counts == [20, 20, 20]
+
+
+def test_split_without_checkpoints_keeps_window():
+    assert make_index([[]]).split(4, (1, 2)) == [(1, 2)]
+
+
+def test_position_is_last_checkpoint_at_or_before():
+    rng = random.Random(1)
+    times = sorted(rng.sample(range(10000), 100))
+    index = make_index([times], step=10, timer_resolution=1000, global_offset=500)
+    for ticks in range(0, 11000, 7):
+        i = bisect.bisect_right(times, ticks)
+        expected = (i - 1) * 10 if i else 0
+        assert index.position(0, (ticks - 500) / 1000.0) == expected
+
+
+def write_trace(path):
+    with otf2.writer.open(str(path), timer_resolution=1000) as trace:
+        root = trace.definitions.system_tree_node("root")
+        group = trace.definitions.location_group("Process", system_tree_parent=root)
+        writers = [trace.event_writer("Thread {}".format(i), group=group) for i in range(3)]
+        region = trace.definitions.region("work")
+        for t in range(0, 3000, 3):
+            for i, writer in enumerate(writers[:1 + (t // 3) % 3]):
+                writer.enter(t + i, region)
+                writer.leave(t + i + 1, region)
+    return str(path / "traces.otf2")
+
+
+class CollectStage(Stage):
+    event_types = (otf2.events._Event,)
+
+    def begin(self, trace):
+        self.events = []
+
+    def process(self, location, event):
+        self.events.append((location.name, type(event).__name__, event.time))
+
+    def finalize(self):
+        return self.events
+
+
+def test_seeking_reads_the_same_window(tmp_path):
+    trace_file = write_trace(tmp_path)
+    windows = [(0.5, 1.5), (2.0, None), (None, 0.1)]
+    expected = [Pipeline([CollectStage()]).run(trace_file, window)[0] for window in windows]
+    index = build_index(trace_file, step=16)
+    assert [Pipeline([CollectStage()]).run(trace_file, window)[0] for window in windows] == expected
+    with otf2.reader.open(trace_file) as trace:
+        assert index.matches(trace.definitions)
+        # Seeking skips the events before the checkpoints
+        assert sum(1 for _ in seek_events(trace, index, 2.0)) < sum(index.locations[i]["events"] for i in range(3)) / 2
@@ -9,8 +9,12 @@ import otf2
 import _otf2
 import os
 import shutil
-from functools import reduce
+import itertools
+from functools import partial, reduce
 import argparse
+from collections import Counter
+from otf2_pipeline import Pipeline, Stage, window_events, window_ticks
+from otf2_timeindex import load_index, seek_events
 
 def gather_traces(trace_folder):
     """Get all traces from each subdirectory of trace_folder"""
@@ -31,9 +35,63 @@ def _update(self, old_key, obj):
 
 otf2.registry._RefRegistry._update = _update
 
-def getSortedEvents(trace_readers, fixup_time):
+def is_sync_event(event):
+    return isinstance(event, otf2.events.ParameterInt) and event.parameter.name == "__syncTime"
+
+def get_sync_events(reader, trace_file, begin):
+    """`__syncTime` parameters before begin (timestamp) from the leading `__init` regions of the trace
+
+       Uses a separate reader which stops once every location has left its leading `__init` region.
+       The events are returned with the locations of reader"""
+    locations = list(reader.definitions.locations)
+    with otf2.reader.open(trace_file) as sync_reader:
+        location_index = {location: i for i, location in enumerate(sync_reader.definitions.locations)}
+        pending = set(location for location in sync_reader.definitions.locations if location.number_of_events > 0)
+        depth = Counter()
+        for location, event in sync_reader.events:
+            if event.time >= begin or not pending:
+                break
+            if is_sync_event(event):
+                yield locations[location_index[location]], event
+            elif isinstance(event, (otf2.events.Enter, otf2.events.Leave)) and event.region.name == "__init":
+                depth[location] += 1 if isinstance(event, otf2.events.Enter) else -1
+            if depth[location] == 0:
+                pending.discard(location)
+
+def drop_unmatched_leaves(events):
+    """Drops Leave events whose Enter lies before the events, so region stacks stay balanced"""
+    depth = Counter()
+    for location, event in events:
+        if isinstance(event, otf2.events.Enter):
+            depth[location] += 1
+        elif isinstance(event, otf2.events.Leave):
+            if depth[location] == 0:
+                continue
+            depth[location] -= 1
+        yield location, event
+
+def get_window_events(reader, trace_file, window):
+    """Events of the reader within the (begin, end) window in seconds since its trace start
+
+       The `__syncTime` parameters of the leading `__init` regions are always included,
+       so the window is synchronized like the whole trace"""
+    index = load_index(trace_file)
+    if index is not None and not index.overlaps(window):
+        # The index shows no events in the window, skip decoding this trace
+        return iter(())
+    begin, end = window_ticks(reader.definitions.clock_properties, window)
+    if begin is None:
+        return window_events(reader.events, begin, end)
+    # With an index the reader starts at the checkpoints before the window
+    events = window_events(seek_events(reader, index, window[0]), begin, end)
+    return itertools.chain(get_sync_events(reader, trace_file, begin), drop_unmatched_leaves(events))
+
+def getSortedEvents(trace_readers, fixup_time, trace_files=None, window=None):
     curEvents = [None for _ in trace_readers]
-    iters = [reader.events.__iter__() for reader in trace_readers]
+    if window is None:
+        iters = [reader.events.__iter__() for reader in trace_readers]
+    else:
+        iters = [get_window_events(reader, trace_files[i], window) for i, reader in enumerate(trace_readers)]
     while True:
         minEl = None
         for i, event in enumerate(curEvents):
@@ -88,6 +146,48 @@ def get_translated_obj(orig_obj, dest):
     except:
         return None
 
+# Definitions that must stay distinct per input even if their content is identical.
+# IoHandles carry per-process state (created/destroyed by events of their process).
+DISTINCT_DEFINITIONS = (otf2.definitions.Location, otf2.definitions.LocationGroup, otf2.definitions.IoHandle)
+
+def intern_key(obj, properties):
+    """Return a key identifying the content of a definition or None if it must not be interned
+
+       properties: The already translated properties, so references to identical definitions are identical"""
+    if isinstance(obj, (otf2.events._Event,) + DISTINCT_DEFINITIONS):
+        return None
+    key = [type(obj)]
+    for property, value in sorted(properties.items()):
+        key.append((property, value if is_trivial_type(value) else id(value)))
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def get_interned_obj(key, dest):
+    try:
+        return dest._interned_objs.get(key)
+    except:
+        return None
+
+def register_interned_obj(key, new_obj, dest):
+    try:
+        interned_objs = dest._interned_objs
+    except:
+        dest._interned_objs = {}
+        dest._interned_duplicates = Counter()
+        interned_objs = dest._interned_objs
+    interned_objs[key] = new_obj
+
+def get_interned_duplicates(dest):
+    """Number of removed duplicate definitions by definition type"""
+    try:
+        return dest._interned_duplicates
+    except:
+        return Counter()
+
 def clone_obj(obj, dest, do_register = True):
     assert(type(do_register) is bool)
     new_obj = get_translated_obj(obj, dest)
@@ -98,7 +198,8 @@ def clone_obj(obj, dest, do_register = True):
     else:
         try:
             registry = dest.definitions._registry_for_type(type(obj))
-            ctor = registry.create
+            # Registries shared by several types (i.e. io_files) have no default type
+            ctor = partial(registry.create, _type=type(obj))
         except:
             raise Exception("Unhandled type found: {}: {}".format(type(obj), obj))
 
@@ -108,7 +209,16 @@ def clone_obj(obj, dest, do_register = True):
             value = clone_obj(value, dest)
         new_obj[property] = value
 
-    new_obj = ctor(**new_obj)
+    # Map definitions with identical content from different inputs to one output definition
+    key = intern_key(obj, new_obj)
+    interned_obj = get_interned_obj(key, dest) if key is not None else None
+    if interned_obj is not None:
+        dest._interned_duplicates[type(obj).__name__] += 1
+        new_obj = interned_obj
+    else:
+        new_obj = ctor(**new_obj)
+        if key is not None:
+            register_interned_obj(key, new_obj, dest)
     if do_register:
         register_translated_obj(obj, new_obj, dest)
     return new_obj
@@ -302,8 +412,62 @@ def prettify_names(trace_readers, trace_files, output_trace):
             outgroup = clone_obj(group, output_trace)
             outgroup.name = group_name
 
-def combine_traces(trace_files, out_folder):
-    """Combine all traces into one and write it into out_folder"""
+class SyncTimeFilter(Stage):
+    """Turns `__syncTime` parameters into clock offsets and drops them"""
+    event_types = (otf2.events.ParameterInt,)
+
+    def __init__(self, output_trace, writer, time_translater):
+        self._output_trace = output_trace
+        self._writer = writer
+        self._time_translater = time_translater
+        self._first_sync_point = None
+
+    def process(self, loc, event):
+        if event.parameter.name != "__syncTime":
+            return True
+        # Translate the epoch to the first timestamp recorded.
+        # This helps keeping the values low which reduces precision errors during translation
+        if self._first_sync_point is None:
+            self._first_sync_point = (event.time, event.value)
+        elapsed_real_time = event.value - self._first_sync_point[1]
+        # From definition of offset: timestamp + offset = realtime
+        # real time is in nanoseconds
+        offset = self._time_translater.translate_resolution(elapsed_real_time, 1e9) - event.time
+        self._writer.clock_offset(clone_obj(loc, self._output_trace), event.time, offset)
+        # Don't write sync params
+        return False
+
+    def finalize(self):
+        for loc_writer in self._writer.loc_writers.values():
+            if len(loc_writer.clock_offsets) == 1:
+                offset = loc_writer.clock_offsets[0][1]
+                last_time = loc_writer.max_time
+                # Offset is assumed to be constant
+                loc_writer.add_clock_offset(last_time, offset)
+
+class InitRegionFilter(Stage):
+    """Drops the enter and leave events of the `__init` meta region"""
+    event_types = (otf2.events.Enter, otf2.events.Leave)
+
+    def process(self, loc, event):
+        return event.region.name != "__init"
+
+class CloneWriterStage(Stage):
+    """Clones every event into the output trace"""
+    event_types = (otf2.events._Event,)
+
+    def __init__(self, output_trace, writer):
+        self._output_trace = output_trace
+        self._writer = writer
+
+    def process(self, loc, event):
+        outloc = clone_obj(loc, self._output_trace)
+        self._writer.write(outloc, clone_event(event, self._output_trace))
+
+def combine_traces(trace_files, out_folder, window=None):
+    """Combine all traces into one and write it into out_folder
+
+       window: Optional (begin, end) in seconds since the start of each trace. Only events within are merged"""
     if not trace_files:
       raise Exception("No traces found")
     trace_readers = []
@@ -319,31 +483,15 @@ def combine_traces(trace_files, out_folder):
 
             with EventWriter(write_trace) as writer:
                 writer.time_translater = time_translater
-                first_sync_point = None
-                for i, (loc, event) in getSortedEvents(trace_readers, time_translater.translate):
-                    outloc = clone_obj(loc, write_trace)
-                    if isinstance(event, otf2.events.ParameterInt) and event.parameter.name == "__syncTime":
-                        # Translate the epoch to the first timestamp recorded.
-                        # This helps keeping the values low which reduces precision errors during translation
-                        if first_sync_point is None:
-                            first_sync_point = (event.time, event.value)
-                        elapsed_real_time = event.value - first_sync_point[1]
-                        # From definition of offset: timestamp + offset = realtime
-                        # real time is in nanoseconds
-                        offset = time_translater.translate_resolution(elapsed_real_time, 1e9) - event.time
-                        writer.clock_offset(outloc, event.time, offset)
-                        # Don't write sync params
-                        continue
-                    if isinstance(event, (otf2.events.Enter, otf2.events.Leave)) and event.region.name == "__init":
-                        continue
-                    event = clone_event(event, write_trace)
-                    writer.write(outloc, event)
-                for loc_writer in writer.loc_writers.values():
-                    if len(loc_writer.clock_offsets) == 1:
-                        offset = loc_writer.clock_offsets[0][1]
-                        last_time = loc_writer.max_time
-                        # Offset is assumed to be constant
-                        loc_writer.add_clock_offset(last_time, offset)
+                pipeline = Pipeline([SyncTimeFilter(write_trace, writer, time_translater),
+                                     InitRegionFilter(),
+                                     CloneWriterStage(write_trace, writer)])
+                sorted_events = getSortedEvents(trace_readers, time_translater.translate, trace_files, window)
+                pipeline.run_events(event for _, event in sorted_events)
+            duplicates = get_interned_duplicates(write_trace)
+            print("Removed {} duplicate definitions{}".format(
+                sum(duplicates.values()),
+                "".join("\n  {}: {}".format(kind, count) for kind, count in sorted(duplicates.items()))))
     finally:
         for reader in trace_readers:
             reader.close()
@@ -365,13 +513,26 @@ def main():
         action = "store_true",
         help="Clean (delete) the output folder if it exists",
     )
+    parser.add_argument(
+        "--begin",
+        type=float,
+        help="Only merge events after this time in seconds since the start of each trace",
+    )
+    parser.add_argument(
+        "--end",
+        type=float,
+        help="Only merge events before this time in seconds since the start of each trace",
+    )
     args = parser.parse_args()
 
     out_folder = args.output
     if os.path.exists(out_folder) and args.clean:
         shutil.rmtree(out_folder)
 
-    combine_traces(gather_traces(args.input), out_folder)
+    window = None
+    if args.begin is not None or args.end is not None:
+        window = (args.begin, args.end)
+    combine_traces(gather_traces(args.input), out_folder, window)
 
 if __name__ == '__main__':
     main()
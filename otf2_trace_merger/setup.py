@@ -6,5 +6,6 @@ setup(
     py_modules=['otf2_trace_merger'],
     install_requires=[
         'future',
+        'otf2_pipeline',
     ],
 )
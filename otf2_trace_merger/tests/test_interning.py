@@ -0,0 +1,70 @@
+import pytest
+
+otf2 = pytest.importorskip("otf2")
+
+from combineTraces import clone_obj, get_interned_duplicates
+
+
+def write_trace(path):
+    with otf2.writer.open(str(path), timer_resolution=1000) as trace:
+        definitions = trace.definitions
+        root = definitions.system_tree_node("root")
+        group = definitions.location_group("Process", system_tree_parent=root)
+        definitions.location("Thread 0", group=group)
+        definitions.attribute("attr", description="an attribute", type=otf2.Type.UINT64)
+        definitions.parameter("param", parameter_type=otf2.ParameterType.INT64)
+        file = definitions.io_regular_file("/tmp/data", scope=root)
+        paradigm = definitions.io_paradigm("POSIX", "POSIX I/O", otf2.IoParadigmClass.SERIAL,
+                                           otf2.IoParadigmFlag.NONE)
+        definitions.io_handle("fd 3", file=file, io_paradigm=paradigm, io_handle_flags=otf2.IoHandleFlag.NONE)
+    return str(path / "traces.otf2")
+
+
+@pytest.fixture
+def merged(tmp_path):
+    """Definitions of two identical inputs cloned into one output, per input"""
+    readers = [otf2.reader.Reader(write_trace(tmp_path / name)) for name in ("a", "b")]
+    try:
+        with otf2.writer.open(str(tmp_path / "merged"), timer_resolution=1000) as output:
+            clones = []
+            for reader in readers:
+                definitions = reader.definitions
+                clones.append({kind: [clone_obj(obj, output) for obj in getattr(definitions, kind)]
+                               for kind in ("attributes", "parameters", "io_files", "locations",
+                                            "location_groups", "io_handles")})
+            yield output, clones
+    finally:
+        for reader in readers:
+            reader.close()
+
+def test_identical_definitions_are_merged_once(merged):
+    output, (a, b) = merged
+    for kind in ("attributes", "parameters", "io_files"):
+        assert a[kind][0] is b[kind][0]
+    assert len(output.definitions.attributes) == 1
+    assert len(output.definitions.parameters) == 1
+    assert len(output.definitions.io_files) == 1
+
+
+def test_locations_groups_and_handles_stay_distinct(merged):
+    output, (a, b) = merged
+    for kind in ("locations", "location_groups", "io_handles"):
+        assert a[kind][0] is not b[kind][0]
+    assert len(output.definitions.locations) == 2
+    assert len(output.definitions.io_handles) == 2
+
+
+def test_references_resolve_to_the_interned_definition(merged):
+    output, (a, b) = merged
+    handle_a, handle_b = a["io_handles"][0], b["io_handles"][0]
+    assert handle_a.file is handle_b.file is a["io_files"][0]
+    assert handle_a.io_paradigm is handle_b.io_paradigm
+
+
+def test_duplicates_are_counted(merged):
+    output, _ = merged
+    duplicates = get_interned_duplicates(output)
+    for name in ("Attribute", "Parameter", "IoRegularFile", "IoParadigm", "SystemTreeNode"):
+        assert duplicates[name] == 1
+    for name in ("Location", "LocationGroup", "IoHandle"):
+        assert duplicates[name] == 0